@@ -0,0 +1,94 @@
+"""Response cache for upstream API calls
+
+Entries live in a small SQLite file so every uWSGI worker shares them.
+Each lookup passes its own time to live, the least recently used entries
+are evicted past maxentries, and hit/miss counts are kept per endpoint.
+
+A hit is a plain read: counts pile up in memory and are written every
+flushseconds, and an entry's last use is only moved once it is older than
+a quarter of the lookup's time to live, so workers don't queue on the
+file's write lock to serve cached data.
+"""
+import atexit
+import json
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache(object):
+    # share of the ttl an entry's last use may lag before a hit moves it
+    touchfraction = 0.25
+
+    def __init__(self, path, maxentries=5000, flushseconds=10):
+        self.path = path
+        self.maxentries = maxentries
+        self.flushseconds = flushseconds
+        self.local = threading.local()
+        self.counts = {}
+        self.countlock = threading.Lock()
+        self.flushedon = time.time()
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, endpoint TEXT, data TEXT, storedon REAL, usedon REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_usedon ON cache (usedon)")
+        conn.execute("CREATE TABLE IF NOT EXISTS stats (endpoint TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)")
+        atexit.register(self.flush)
+
+    def connect(self):
+        """One connection per thread"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self.local.conn = conn
+        return conn
+
+    def count(self, endpoint, hit):
+        with self.countlock:
+            self.counts.setdefault(endpoint, [0, 0])[0 if hit else 1] += 1
+            due = time.time() - self.flushedon >= self.flushseconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the hit/miss counts kept in memory to the shared stats table"""
+        with self.countlock:
+            counts, self.counts = self.counts, {}
+            self.flushedon = time.time()
+        if not counts:
+            return
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN")
+            for endpoint, (hits, misses) in counts.items():
+                conn.execute("INSERT OR IGNORE INTO stats (endpoint, hits, misses) VALUES (?, 0, 0)", (endpoint,))
+                conn.execute("UPDATE stats SET hits = hits + ?, misses = misses + ? WHERE endpoint = ?", (hits, misses, endpoint))
+
+    def get(self, endpoint, key, ttl):
+        """Cached data for key if newer than ttl seconds, else None"""
+        now = time.time()
+        conn = self.connect()
+        row = conn.execute("SELECT data, usedon FROM cache WHERE key = ? AND storedon > ?", (key, now - ttl)).fetchone()
+        self.count(endpoint, row is not None)
+        if row is None:
+            return None
+        if now - row[1] > ttl * self.touchfraction:
+            conn.execute("UPDATE cache SET usedon = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, endpoint, key, data):
+        now = time.time()
+        conn = self.connect()
+        conn.execute("INSERT OR REPLACE INTO cache (key, endpoint, data, storedon, usedon) VALUES (?, ?, ?, ?, ?)", (key, endpoint, json.dumps(data), now, now))
+        # LRU eviction
+        conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY usedon DESC LIMIT -1 OFFSET ?)", (self.maxentries,))
+
+    def stats(self):
+        """Hit/miss counts per endpoint"""
+        self.flush()
+        rows = self.connect().execute("SELECT endpoint, hits, misses FROM stats ORDER BY endpoint").fetchall()
+        return [{"endpoint": endpoint, "hits": hits, "misses": misses} for endpoint, hits, misses in rows]
+
+    def clear(self):
+        self.connect().execute("DELETE FROM cache")
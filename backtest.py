@@ -0,0 +1,208 @@
+"""Offline backtest of the strike selection rules over stored chain snapshots
+
+Replays the last snapshot of every day for each symbol. When no trade is
+open for the symbol it opens one with the same rule the calculators use,
+marks it to market each day and settles it at expiration (expired or
+assigned). Each symbol's days are scored in one pass and symbols run in
+separate processes.
+
+Rules:
+    csp      highest opti put, then highest strike (csp, /new)
+    highror  best (opti + 2 * ror) / 3 with ror >= 0.30 (autocalc)
+    spread   top put spread by credit/width, then ror, then otm (/ps)
+
+    python3 backtest.py SNAPSHOT_PATH --rule csp --processes 4 --trades trades.csv
+"""
+import argparse
+import csv
+import multiprocessing
+import sys
+from functools import partial
+
+import numpy as np
+
+import scoring
+import spreads
+from snapshots import SnapshotStore
+
+rules = ("csp", "highror", "spread")
+
+tradefields = ["symbol", "rule", "opened", "closed", "expirationdate", "strike1", "strike2", "initprem", "closeprem", "premcap", "status", "pnl", "ror"]
+
+
+def loadsymbol(store, symbol):
+    """Last snapshot of each day for a symbol as one array, returns (dates, chain, bounds)
+
+    Rows of day i are chain[bounds[i]:bounds[i + 1]].
+    """
+    dates = []
+    snaps = []
+    for date in store.dates(symbol):
+        snap = store.last(symbol, date)
+        if snap is not None and len(snap):
+            dates.append(date)
+            snaps.append(snap)
+    if not snaps:
+        return [], None, None
+    bounds = np.concatenate([[0], np.cumsum([len(snap) for snap in snaps])])
+    return dates, np.concatenate(snaps), bounds
+
+def scoresymbol(dates, chain, bounds):
+    """Score every day of a symbol at once, returns the score columns plus day and numdays"""
+    day = np.repeat(np.arange(len(dates)), np.diff(bounds))
+    numdays = (chain["expirationdate"] - np.array(dates, dtype="datetime64[D]")[day]).astype(int)
+    score = scoring.scorechain(chain, chain["underlying"], numdays)
+    score["day"] = day
+    score["numdays"] = numdays
+    return score
+
+def bestbyday(day, mask, *keys):
+    """Row with the largest keys (first key first) per day among mask rows, returns {day: row}"""
+    rows = np.flatnonzero(mask)
+    if not len(rows):
+        return {}
+    order = rows[np.lexsort(tuple(key[rows] for key in reversed(keys)) + (day[rows],))]
+    last = np.flatnonzero(np.append(day[order][1:] != day[order][:-1], True))
+    return dict(zip(day[order][last].tolist(), order[last].tolist()))
+
+def picktrades(rule, chain, bounds, score):
+    """Entry for each day the rule finds one, returns {day: (short row, long row or None)}"""
+    mid = score["mid"]
+    numdays = score["numdays"]
+    isput = chain["isput"]
+    # what updatestrikes keeps in the strikes table
+    stored = ((chain["asksize"] * chain["bidsize"]) > 1) & (chain["open_interest"] > 1) & (mid > 0) & (15 < numdays) & (numdays < 100)
+    cspmask = stored & score["outofmoney"] & (score["opti"] > 0)
+    if rule == "csp":
+        best = bestbyday(score["day"], cspmask, score["opti"], chain["strike"])
+        return dict((day, (row, None)) for day, row in best.items())
+    if rule == "highror":
+        roundedprice = scoring.roundto(chain["underlying"], 0.05)
+        mask = (chain["open_interest"] > 2) & (chain["asksize"] > 1) & (chain["bidsize"] > 1) & (mid > 0) & isput & (chain["strike"] <= roundedprice) & (6 < numdays) & (numdays < 62) & (score["ror"] >= 0.30)
+        # ties go to the first row, as in the autocalc loop
+        best = bestbyday(score["day"], mask, (score["opti"] + score["ror"] * 2) / 3, -np.arange(len(chain)))
+        return dict((day, (row, None)) for day, row in best.items())
+    # put spread - the top pair putspreads finds among the day's stored puts, as on /ps
+    puts = stored & isput
+    opti = np.where(score["outofmoney"], score["opti"], 0)
+    picks = {}
+    for day in range(len(bounds) - 1):
+        rows = bounds[day] + np.flatnonzero(puts[bounds[day]:bounds[day + 1]])
+        if not len(rows):
+            continue
+        best = spreads.putspreads(np.zeros(len(rows)), chain["expirationdate"][rows], chain["strike"][rows], mid[rows], numdays[rows], opti[rows], chain["underlying"][rows], k=1)
+        # one symbol, so at most one list of one spread
+        for spread, in best.values():
+            sameexp = rows[chain["expirationdate"][rows] == np.datetime64(spread["expirationdate"])]
+            picks[day] = (sameexp[chain["strike"][sameexp] == spread["shortstrike"]][0], sameexp[chain["strike"][sameexp] == spread["longstrike"]][0])
+    return picks
+
+def legprice(chain, mid, lo, hi, row):
+    """Mid of the same contract as row within rows lo:hi, or None if it is not quoted"""
+    same = np.flatnonzero((chain["expirationdate"][lo:hi] == chain["expirationdate"][row]) & (chain["strike"][lo:hi] == chain["strike"][row]) & (chain["isput"][lo:hi] == chain["isput"][row]))
+    if not len(same):
+        return None
+    return float(mid[lo + same[0]])
+
+def premcap(initprem, closeprem):
+    """Percent of the opening premium captured, in steps of 5 like traderefresh"""
+    return float(scoring.roundto((initprem - closeprem) / initprem, 0.05)) * 100
+
+def simulate(symbol, rule, dates, chain, bounds, score, picks, takeprofit=None):
+    """Run one trade at a time through the days, returns the trade dicts"""
+    mid = score["mid"]
+    trades = []
+    trade = None
+    for day in range(len(dates)):
+        lo, hi = bounds[day], bounds[day + 1]
+        underlying = float(chain["underlying"][lo])
+        if trade is not None:
+            if dates[day] >= trade["expirationdate"]:
+                # settle at expiration
+                intrinsic = max(0.0, trade["strike1"] - underlying)
+                if trade["strike2"]:
+                    intrinsic = min(intrinsic, trade["strike1"] - trade["strike2"])
+                trade.update(closed=dates[day], closeprem=intrinsic, premcap=premcap(trade["initprem"], intrinsic), status="assigned" if intrinsic > 0 else "expired")
+            else:
+                # mark to market
+                shortprem = legprice(chain, mid, lo, hi, trade["shortrow"])
+                longprem = legprice(chain, mid, lo, hi, trade["longrow"]) if trade["longrow"] is not None else 0.0
+                if shortprem is not None and longprem is not None:
+                    trade["closeprem"] = shortprem - longprem
+                    trade["premcap"] = premcap(trade["initprem"], trade["closeprem"])
+                    if takeprofit and trade["premcap"] >= takeprofit * 100:
+                        trade.update(closed=dates[day], status="closed")
+            if trade["status"] != "open":
+                trades.append(closetrade(trade))
+                trade = None
+        if trade is None and day in picks:
+            short, long = picks[day]
+            initprem = float(mid[short]) - (float(mid[long]) if long is not None else 0.0)
+            if initprem > 0:
+                trade = {"symbol": symbol, "rule": rule, "opened": dates[day], "closed": "", "expirationdate": str(chain["expirationdate"][short]),
+                         "strike1": float(chain["strike"][short]), "strike2": float(chain["strike"][long]) if long is not None else 0.0,
+                         "initprem": initprem, "closeprem": initprem, "premcap": 0.0, "status": "open", "shortrow": short, "longrow": long}
+    if trade is not None:
+        trades.append(closetrade(trade))
+    return trades
+
+def closetrade(trade):
+    """Profit per share and return on the collateral (strike, or width for spreads)"""
+    collateral = trade["strike1"] - trade["strike2"]
+    for field in ("initprem", "closeprem", "premcap"):
+        trade[field] = round(trade[field], 4)
+    trade["pnl"] = round(trade["initprem"] - trade["closeprem"], 4)
+    trade["ror"] = round(trade["pnl"] / collateral * 100, 3) if collateral else 0.0
+    return dict((field, trade[field]) for field in tradefields)
+
+def backtestsymbol(root, rule, takeprofit, symbol):
+    """All the trades for one symbol"""
+    dates, chain, bounds = loadsymbol(SnapshotStore(root), symbol)
+    if not dates:
+        return []
+    score = scoresymbol(dates, chain, bounds)
+    picks = picktrades(rule, chain, bounds, score)
+    return simulate(symbol, rule, dates, chain, bounds, score, picks, takeprofit)
+
+def backtest(root, rule="csp", symbols=None, processes=None, takeprofit=None):
+    """Backtest a rule over every symbol in the snapshot store, returns the trade dicts"""
+    symbols = symbols or SnapshotStore(root).symbols()
+    run = partial(backtestsymbol, root, rule, takeprofit)
+    if processes == 1:
+        results = map(run, symbols)
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(run, symbols)
+    return [trade for trades in results for trade in trades]
+
+def summary(trades):
+    closed = [trade for trade in trades if trade["status"] != "open"]
+    return {
+        "trades": len(trades),
+        "closed": len(closed),
+        "wins": len([trade for trade in closed if trade["pnl"] > 0]),
+        "assigned": len([trade for trade in closed if trade["status"] == "assigned"]),
+        "pnl": round(sum(trade["pnl"] for trade in closed) * 100, 2),
+        "avgror": round(sum(trade["ror"] for trade in closed) / len(closed), 3) if closed else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the OpenCalc strike selection rules")
+    parser.add_argument("root", help="snapshot folder (SNAPSHOT_PATH)")
+    parser.add_argument("--rule", choices=rules, default="csp")
+    parser.add_argument("--symbols", help="comma separated, default all")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--takeprofit", type=float, default=None, help="close at this share of premium captured, e.g. 0.5")
+    parser.add_argument("--trades", help="write every trade to this CSV file")
+    args = parser.parse_args()
+
+    symbols = args.symbols.upper().split(",") if args.symbols else None
+    trades = backtest(args.root, args.rule, symbols, args.processes, args.takeprofit)
+    if args.trades:
+        with open(args.trades, "w", newline="") as tradesfile:
+            writer = csv.DictWriter(tradesfile, fieldnames=tradefields)
+            writer.writeheader()
+            writer.writerows(trades)
+    for name, value in summary(trades).items():
+        sys.stdout.write("%s: %s\n" % (name, value))
@@ -0,0 +1,325 @@
+"""Benchmark the heavy routes against a local stand-in for Tradier and IEX
+
+Starts a small HTTP server in its own process that answers the Tradier
+quotes, expirations and chains endpoints and the IEX key stats and price
+target calls with synthetic, repeatable data. The app runs in process on a
+temp SQLite database seeded with one user, a watchlist of every symbol, the
+strikes for each and one open trade per symbol. Each route is then timed
+and the throughput, p50/p99 latency, peak Python memory, SQL statements and
+upstream calls per request are reported.
+
+Routes: updatestrikes, new, traderefresh, manual (getorigoptinf), posit
+
+    python3 benchmark.py --symbols 20 --strikes 500 --requests 30 --json before.json
+    python3 benchmark.py --symbols 20 --strikes 500 --requests 30 --compare before.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+import zlib
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import requests
+
+routes = ("updatestrikes", "new", "traderefresh", "manual", "posit")
+
+resultfields = ["requests", "rps", "p50ms", "p99ms", "peakmib", "sqlperreq", "callsperreq"]
+
+
+# SYNTHETIC MARKET
+
+def symbolnames(count):
+    return ["S%03i" % i for i in range(count)]
+
+def underlying(sym):
+    """Repeatable price between 20 and 420 for a symbol"""
+    return round(20 + zlib.crc32(sym.encode()) % 40000 / 100.0, 2)
+
+def expirations(count):
+    """count expiration dates two weeks apart, the first 4 days out"""
+    today = date.today()
+    return [str(today + timedelta(days=4 + 14 * i)) for i in range(count)]
+
+def chain(sym, expdate, strikes):
+    """strikes options (puts and calls) from 50% to 150% of the price"""
+    rnd = random.Random(sym + expdate)
+    price = underlying(sym)
+    levels = max(strikes // 2, 1)
+    options = []
+    for i in range(levels):
+        strike = round(price * (0.5 + i / levels), 2)
+        for optiontype in ("put", "call"):
+            intrinsic = max(0.0, strike - price if optiontype == "put" else price - strike)
+            bid = round(intrinsic + rnd.random() * price * 0.03, 2)
+            options.append({
+                "symbol": sym, "strike": strike, "option_type": optiontype, "expiration_date": expdate,
+                "bid": bid, "ask": round(bid + rnd.random() * 0.4, 2),
+                "bidsize": rnd.randint(0, 30), "asksize": rnd.randint(0, 30),
+                "open_interest": rnd.randint(0, 2000), "volume": rnd.randint(0, 500), "average_volume": rnd.randint(0, 500),
+            })
+    return options
+
+def quote(sym):
+    return {"symbol": sym, "last": underlying(sym), "volume": 1000000, "description": sym + " Synthetic Inc", "type": "stock"}
+
+def keystats(sym):
+    return {"day200MovingAvg": round(underlying(sym) * 0.95, 2), "nextEarningsDate": str(date.today() + timedelta(days=30)), "peRatio": 18.5}
+
+def pricetarget(sym):
+    return {"priceTargetAverage": round(underlying(sym) * 1.1, 2)}
+
+
+# STAND-IN SERVER
+
+class StandIn(BaseHTTPRequestHandler):
+    strikes = 200
+    expirations = 8
+    latency = 0.0
+    chains = {}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        path = url.path.rstrip("/")
+        if path == "/v1/markets/quotes":
+            quotes = [quote(sym) for sym in params["symbols"].split(",")]
+            data = {"quotes": {"quote": quotes[0] if len(quotes) == 1 else quotes}}
+        elif path == "/v1/markets/options/expirations":
+            data = {"expirations": {"date": expirations(self.expirations)}}
+        elif path == "/v1/markets/options/chains":
+            key = (params["symbol"], params["expiration"])
+            if key not in self.chains:
+                self.chains[key] = json.dumps({"options": {"option": chain(params["symbol"], params["expiration"], self.strikes)}}).encode()
+            return self.reply(self.chains[key])
+        elif path.startswith("/iex/stats/"):
+            data = self.iex(path, keystats)
+        elif path.startswith("/iex/price-target/"):
+            data = self.iex(path, pricetarget)
+        else:
+            self.send_error(404)
+            return
+        self.reply(json.dumps(data).encode())
+
+    def iex(self, path, fn):
+        symbols = path.rsplit("/", 1)[1].split(",")
+        if len(symbols) == 1:
+            return fn(symbols[0])
+        return dict((sym, fn(sym)) for sym in symbols)
+
+    def reply(self, body):
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def serve(conn, strikes, expirationcount, latency):
+    StandIn.strikes = strikes
+    StandIn.expirations = expirationcount
+    StandIn.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    conn.send(server.server_address[1])
+    server.serve_forever()
+
+class StandInStock(object):
+    """Replaces iexfinance Stock, takes one symbol or a list like the real one"""
+    url = None
+
+    def __init__(self, symbols, token=None, **kwargs):
+        self.symbols = symbols if isinstance(symbols, str) else ",".join(symbols)
+
+    def get_key_stats(self):
+        return requests.get(self.url + "/iex/stats/" + self.symbols).json()
+
+    def get_price_target(self):
+        return requests.get(self.url + "/iex/price-target/" + self.symbols).json()
+
+
+# APP SETUP
+
+def writesettings(folder, url, cache):
+    settings = {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(folder, "benchmark.db"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "SECRET_KEY": "benchmark",
+        "WTF_CSRF_ENABLED": False,
+        "MYAUTHY": "Bearer benchmark",
+        "IAUTHUSER": "benchmark",
+        "IAUTHPASS": "benchmark",
+        "IEX_TOKEN": "benchmark",
+        "REGKEY": "benchmark",
+        "TRADIER_URL": url + "/v1/",
+        "TRADIER_CACHE_PATH": os.path.join(folder, "tradiercache.db"),
+        "IEX_CACHE_PATH": os.path.join(folder, "iexcache.db"),
+    }
+    if not cache:
+        settings["TRADIER_CACHE_TTL"] = {}
+    with open(os.path.join(folder, "settings.py"), "w") as settingsfile:
+        for name, value in settings.items():
+            settingsfile.write("%s = %r\n" % (name, value))
+
+def seed(opencalc, symbols):
+    """One user with every symbol on the watchlist, its strikes and one open CSP each"""
+    db = opencalc.db
+    user = opencalc.User("benchmark", "benchmark", "benchmark@localhost", "BENCHMARK")
+    db.session.add(user)
+    db.session.commit()
+    for sym in symbols:
+        db.session.add(opencalc.Ticker(sym, underlying(sym), user.id, 1000000, sym + " Synthetic Inc", "stock"))
+    db.session.commit()
+    for result in opencalc.refreshsymbols(symbols):
+        if result["error"]:
+            raise RuntimeError("seeding %s failed: %s" % (result["symbol"], result["error"]))
+    for best in opencalc.bestputs.query.all():
+        db.session.add(opencalc.Trade(best.symbol, "P", best.expirationdate, best.strike, 0, best.premium, best.numdays, best.opti, 1, 0, user.id))
+    db.session.commit()
+
+def routepaths(route, symbols, expdates):
+    """Endless paths for a route, cycling through the symbols"""
+    i = 0
+    while True:
+        sym = symbols[i % len(symbols)]
+        if route == "updatestrikes":
+            yield "/updatestrikes/" + sym
+        elif route == "new":
+            yield "/new"
+        elif route == "traderefresh":
+            yield "/traderefresh"
+        elif route == "manual":
+            yield "/manual/oi/%s&%s" % (sym, expdates[i % len(expdates)])
+        else:
+            yield "/posit"
+        i += 1
+
+
+# MEASUREMENT
+
+def upstreamcalls(metrics):
+    return sum(count for (name, labels), (counts, total, count) in list(metrics.histograms.items()) if name == "opencalc_upstream_seconds")
+
+def sqlstatements(metrics):
+    return metrics.counters.get(("opencalc_sql_statements_total", ()), 0)
+
+def get(client, path):
+    resp = client.get(path)
+    if resp.status_code >= 400:
+        raise RuntimeError("%s returned %i" % (path, resp.status_code))
+    return resp
+
+def measure(opencalc, client, paths, count):
+    """Time count requests, then one more under tracemalloc for the peak memory"""
+    get(client, next(paths))
+    sql = sqlstatements(opencalc.metrics)
+    calls = upstreamcalls(opencalc.metrics)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(count):
+        requeststarted = time.perf_counter()
+        get(client, next(paths))
+        latencies.append(time.perf_counter() - requeststarted)
+    elapsed = time.perf_counter() - started
+    sql = sqlstatements(opencalc.metrics) - sql
+    calls = upstreamcalls(opencalc.metrics) - calls
+    tracemalloc.start()
+    get(client, next(paths))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "requests": count,
+        "rps": round(count / elapsed, 2),
+        "p50ms": round(float(np.percentile(latencies, 50)) * 1000, 2),
+        "p99ms": round(float(np.percentile(latencies, 99)) * 1000, 2),
+        "peakmib": round(peak / 1048576.0, 2),
+        "sqlperreq": round(sql / float(count), 1),
+        "callsperreq": round(calls / float(count), 1),
+    }
+
+def report(params, results, previous=None):
+    sys.stdout.write("symbols %(symbols)i, %(strikes)i options per chain, %(expirations)i expirations, %(latency)ims upstream latency, cache %(cache)s\n" % params)
+    if previous and previous["params"] != params:
+        sys.stdout.write("note: compared run used different parameters %s\n" % previous["params"])
+    sys.stdout.write("%-14s" % "route" + "".join("%12s" % field for field in resultfields) + "\n")
+    for route, result in results.items():
+        sys.stdout.write("%-14s" % route + "".join("%12s" % result[field] for field in resultfields) + "\n")
+        before = (previous or {}).get("results", {}).get(route)
+        if before:
+            changes = []
+            for field in resultfields[1:]:
+                if before[field]:
+                    changes.append("%+.1f%%" % ((result[field] - before[field]) * 100.0 / before[field]))
+                else:
+                    changes.append("-")
+            sys.stdout.write("%-14s" % "  vs before" + "%12s" % "" + "".join("%12s" % change for change in changes) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the OpenCalc routes against a local Tradier/IEX stand-in")
+    parser.add_argument("--symbols", type=int, default=10, help="symbols on the watchlist (1-200)")
+    parser.add_argument("--strikes", type=int, default=200, help="options per chain (50-10000)")
+    parser.add_argument("--expirations", type=int, default=8, help="expiration dates per symbol")
+    parser.add_argument("--requests", type=int, default=20, help="timed requests per route")
+    parser.add_argument("--routes", default=",".join(routes), help="comma separated, default all")
+    parser.add_argument("--latency", type=int, default=0, help="milliseconds the stand-in waits before each reply")
+    parser.add_argument("--cache", action="store_true", help="keep the Tradier response cache on")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+    for route in args.routes.split(","):
+        if route not in routes:
+            parser.error("unknown route %s, choose from %s" % (route, ", ".join(routes)))
+
+    parentconn, childconn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(childconn, args.strikes, args.expirations, args.latency / 1000.0), daemon=True)
+    server.start()
+    url = "http://127.0.0.1:%i" % parentconn.recv()
+    StandInStock.url = url
+
+    with tempfile.TemporaryDirectory() as folder:
+        writesettings(folder, url, args.cache)
+        sys.path.insert(0, folder)
+        import opencalc
+        # keep the report readable, flask_wtf turns its deprecation warnings on at import
+        warnings.simplefilter("ignore", DeprecationWarning)
+        opencalc.Stock = StandInStock
+        symbols = symbolnames(args.symbols)
+        seed(opencalc, symbols)
+
+        client = opencalc.app.test_client()
+        get(client, "/login")
+        client.post("/login", data={"username": "benchmark", "password": "benchmark"})
+
+        results = {}
+        for route in args.routes.split(","):
+            results[route] = measure(opencalc, client, routepaths(route, symbols, expirations(args.expirations)), args.requests)
+        opencalc.db.session.remove()
+        opencalc.db.engine.dispose()
+    server.terminate()
+
+    params = {"symbols": args.symbols, "strikes": args.strikes, "expirations": args.expirations, "latency": args.latency, "cache": args.cache}
+    previous = None
+    if args.compare:
+        with open(args.compare) as comparefile:
+            previous = json.load(comparefile)
+    report(params, results, previous)
+    if args.json:
+        with open(args.json, "w") as jsonfile:
+            json.dump({"params": params, "results": results}, jsonfile, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Black-Scholes implied volatility and Greeks for whole option chains
+
+Everything works on arrays: the solver runs safeguarded Newton steps on
+every contract at once, falling back to bisection inside a per-contract
+bracket whenever a step leaves it, so 10k contracts solve in milliseconds.
+Contracts priced outside the no-arbitrage bounds, already expired, or not
+solved within maxiter steps get NaN.
+"""
+import math
+
+import numpy as np
+
+sqrt2pi = math.sqrt(2 * math.pi)
+
+# Volatility bracket for the solver
+minvol = 1e-4
+maxvol = 5.0
+
+
+def normpdf(x):
+    return np.exp(-0.5 * x * x) / sqrt2pi
+
+def normcdf(x):
+    """Standard normal CDF (Abramowitz & Stegun 26.2.17, error under 7.5e-8)
+
+    The tail is figured directly, so far out of the money prices keep their
+    relative accuracy.
+    """
+    x = np.asarray(x, dtype=float)
+    k = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    tail = normpdf(x) * k * (0.319381530 + k * (-0.356563782 + k * (1.781477937 + k * (-1.821255978 + k * 1.330274429))))
+    return np.where(x >= 0, 1.0 - tail, tail)
+
+def d1d2(spot, strike, t, vol, rate):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        volt = vol * np.sqrt(t)
+        d1 = (np.log(spot / strike) + (rate + 0.5 * vol * vol) * t) / volt
+    return d1, d1 - volt
+
+def bsprice(isput, spot, strike, t, vol, rate=0.0):
+    """Black-Scholes price of European puts (isput) and calls"""
+    d1, d2 = d1d2(spot, strike, t, vol, rate)
+    disc = strike * np.exp(-rate * t)
+    call = spot * normcdf(d1) - disc * normcdf(d2)
+    put = disc * normcdf(-d2) - spot * normcdf(-d1)
+    return np.where(isput, put, call)
+
+def impliedvol(price, isput, spot, strike, t, rate=0.0, tol=1e-6, maxiter=50):
+    """Implied volatility for each contract, NaN where there is none or it did not converge"""
+    price, isput, spot, strike, t = np.broadcast_arrays(np.asarray(price, dtype=float), np.asarray(isput, dtype=bool), np.asarray(spot, dtype=float), np.asarray(strike, dtype=float), np.asarray(t, dtype=float))
+    disc = strike * np.exp(-rate * t)
+    lower = np.where(isput, np.maximum(disc - spot, 0.0), np.maximum(spot - disc, 0.0))
+    upper = np.where(isput, disc, spot)
+    with np.errstate(invalid="ignore"):
+        valid = (t > 0) & (spot > 0) & (strike > 0) & (price > lower) & (price < upper)
+
+    vol = np.full(price.shape, np.nan)
+    idx = np.flatnonzero(valid)
+    if not len(idx):
+        return vol
+    p, put, s, k, tt = price.flat[idx], isput.flat[idx], spot.flat[idx], strike.flat[idx], t.flat[idx]
+    lo = np.full(len(idx), minvol)
+    hi = np.full(len(idx), maxvol)
+    # Brenner-Subrahmanyam start
+    v = np.clip(sqrt2pi / np.sqrt(tt) * p / s, 0.05, 2.0)
+    active = np.arange(len(idx))
+    for i in range(maxiter):
+        va = v[active]
+        diff = bsprice(put[active], s[active], k[active], tt[active], va, rate) - p[active]
+        done = np.abs(diff) < tol
+        # price rises with vol, so the bracket closes on the root
+        hi[active] = np.where(diff > 0, va, hi[active])
+        lo[active] = np.where(diff < 0, va, lo[active])
+        d1 = d1d2(s[active], k[active], tt[active], va, rate)[0]
+        vega = s[active] * normpdf(d1) * np.sqrt(tt[active])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = va - diff / vega
+        inside = (step > lo[active]) & (step < hi[active])
+        v[active] = np.where(done, va, np.where(inside, step, 0.5 * (lo[active] + hi[active])))
+        active = active[~done]
+        if not len(active):
+            break
+    # still off by more than tol after maxiter steps
+    v[active] = np.nan
+    vol.flat[idx] = v
+    return vol
+
+def greeks(isput, spot, strike, t, vol, rate=0.0):
+    """Delta, gamma, theta (per calendar day) and vega (per vol point) for each contract"""
+    d1, d2 = d1d2(spot, strike, t, vol, rate)
+    pdf = normpdf(d1)
+    sqrtt = np.sqrt(t)
+    disc = strike * np.exp(-rate * t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        decay = -spot * pdf * vol / (2 * sqrtt)
+        return {
+            "delta": np.where(isput, normcdf(d1) - 1.0, normcdf(d1)),
+            "gamma": pdf / (spot * vol * sqrtt),
+            "theta": np.where(isput, decay + rate * disc * normcdf(-d2), decay - rate * disc * normcdf(d2)) / 365,
+            "vega": spot * pdf * sqrtt / 100,
+        }
+
+def chaingreeks(cols, currprice, numdays, rate=0.0):
+    """IV and Greeks from the bid/ask mid of chaincolumns() arrays
+
+    numdays is a scalar or one value per option. Returns arrays for iv,
+    delta, gamma, theta and vega.
+    """
+    t = np.asarray(numdays, dtype=float) / 365
+    mid = (cols["bid"] + cols["ask"]) / 2
+    iv = impliedvol(mid, cols["isput"], currprice, cols["strike"], t, rate)
+    result = greeks(cols["isput"], currprice, cols["strike"], t, iv, rate)
+    result["iv"] = iv
+    return result
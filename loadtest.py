@@ -0,0 +1,128 @@
+"""Load test - how many slow refreshes a deployment absorbs before fast routes stall
+
+Logs in to a running OpenCalc, then steps up the number of clients looping
+on a slow route (updatestrikes by default) and at each step probes a fast
+route (/posit) for a while. A step passes while the fast route's p99 stays
+under --stall-ms. Reports each step and the highest one that passed.
+
+    uwsgi --ini opencalc-production.ini --http :8000
+    python3 loadtest.py http://localhost:8000 USERNAME PASSWORD --symbols AAPL,MSFT --max-slow 32
+
+Point TRADIER_URL at the benchmark.py stand-in to run it without API keys.
+"""
+import argparse
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+
+def dropconnection(resp, *args, **kwargs):
+    # uwsgi --http closes the connection after each response without saying so,
+    # a pooled connection would fail on the next request
+    resp.connection.close()
+
+def login(url, username, password):
+    session = requests.Session()
+    session.hooks["response"].append(dropconnection)
+    resp = session.post(url + "/login", data={"username": username, "password": password}, allow_redirects=False)
+    if resp.status_code != 302 or "/login" in resp.headers.get("Location", ""):
+        raise RuntimeError("login failed for " + username)
+    return session
+
+def slowclient(url, username, password, paths, stop, completed, errors):
+    """Loop on the slow paths until stopped"""
+    session = login(url, username, password)
+    i = 0
+    while not stop.is_set():
+        try:
+            resp = session.get(url + paths[i % len(paths)], allow_redirects=False, timeout=300)
+            if resp.status_code >= 400:
+                errors.append(resp.status_code)
+            else:
+                completed.append(1)
+        except requests.RequestException as e:
+            errors.append(str(e))
+        i += 1
+
+def probe(session, url, path, seconds, interval):
+    """Latencies of the fast path for a number of seconds, None for a failed request"""
+    latencies = []
+    until = time.time() + seconds
+    while time.time() < until:
+        started = time.perf_counter()
+        try:
+            resp = session.get(url + path, timeout=60)
+            latencies.append(time.perf_counter() - started if resp.status_code < 400 else None)
+        except requests.RequestException:
+            latencies.append(None)
+        time.sleep(interval)
+    return latencies
+
+def step(args, slowpaths, session, slowcount):
+    """Run slowcount slow clients while probing the fast path"""
+    stop = threading.Event()
+    completed = []
+    errors = []
+    clients = [threading.Thread(target=slowclient, args=(args.url, args.username, args.password, slowpaths, stop, completed, errors), daemon=True) for i in range(slowcount)]
+    for client in clients:
+        client.start()
+    # let the slow requests get going before measuring
+    time.sleep(args.warmup if slowcount else 0)
+    latencies = probe(session, args.url, args.fast, args.seconds, args.interval)
+    stop.set()
+    ok = [latency for latency in latencies if latency is not None]
+    result = {
+        "slow": slowcount,
+        "probes": len(latencies),
+        "failed": len(latencies) - len(ok),
+        "p50ms": round(float(np.percentile(ok, 50)) * 1000, 1) if ok else None,
+        "p99ms": round(float(np.percentile(ok, 99)) * 1000, 1) if ok else None,
+        "slowdone": len(completed),
+        "slowerrors": len(errors),
+    }
+    result["passed"] = bool(ok) and not result["failed"] and result["p99ms"] < args.stall_ms
+    for client in clients:
+        client.join(300)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Step up slow refresh load on an OpenCalc deployment and watch a fast route")
+    parser.add_argument("url", help="base url, e.g. http://localhost:8000")
+    parser.add_argument("username")
+    parser.add_argument("password")
+    parser.add_argument("--symbols", required=True, help="comma separated watchlist symbols for the slow route")
+    parser.add_argument("--slow", default="/updatestrikes/%s", help="slow path, %%s is replaced by each symbol")
+    parser.add_argument("--fast", default="/posit", help="fast path to probe")
+    parser.add_argument("--max-slow", type=int, default=32, help="most slow clients, doubled from 1 each step")
+    parser.add_argument("--seconds", type=float, default=10, help="probe time per step")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between probes")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds to let the slow clients start each step")
+    parser.add_argument("--stall-ms", type=float, default=1000, help="fast route p99 above this is a stall")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+
+    slowpaths = [args.slow % sym if "%s" in args.slow else args.slow for sym in args.symbols.upper().split(",")]
+    session = login(args.url, args.username, args.password)
+
+    counts = [0]
+    while counts[-1] < args.max_slow:
+        counts.append(max(1, counts[-1] * 2))
+    absorbed = None
+    sys.stdout.write("%6s %8s %8s %10s %10s %10s %10s\n" % ("slow", "probes", "failed", "p50ms", "p99ms", "slowdone", "slowerrs"))
+    for slowcount in counts:
+        result = step(args, slowpaths, session, min(slowcount, args.max_slow))
+        sys.stdout.write("%(slow)6s %(probes)8s %(failed)8s %(p50ms)10s %(p99ms)10s %(slowdone)10s %(slowerrors)10s" % result)
+        sys.stdout.write("\n" if result["passed"] else "   STALLED\n")
+        if not result["passed"]:
+            break
+        absorbed = result["slow"]
+    sys.stdout.write("absorbed %s concurrent slow clients with %s p99 under %ims\n" % (absorbed, args.fast, args.stall_ms))
+    return 0 if absorbed is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
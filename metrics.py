@@ -0,0 +1,193 @@
+"""Request and upstream call instrumentation
+
+Keeps counters and latency histograms in process and renders them in the
+Prometheus text format. Each uWSGI worker has its own set, so a scrape
+reports the worker that answered it.
+
+Per-request totals (upstream calls, SQL statements, scoring time) are kept
+on the thread handling the request. Work handed to a thread pool carries
+them along with bind().
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency histogram buckets in seconds
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+descriptions = {
+    "opencalc_request_seconds": ("histogram", "Wall time per route"),
+    "opencalc_request_sql_statements_total": ("counter", "SQL statements run per route"),
+    "opencalc_request_upstream_calls_total": ("counter", "Outbound API calls made per route"),
+    "opencalc_upstream_seconds": ("histogram", "Latency of outbound Tradier, IEX and Intrinio calls"),
+    "opencalc_scoring_seconds": ("histogram", "Time spent scoring option chains"),
+    "opencalc_sql_statements_total": ("counter", "SQL statements run, in and out of requests"),
+    "opencalc_tradier_cache_hits_total": ("counter", "Tradier responses served from the cache, all workers"),
+    "opencalc_tradier_cache_misses_total": ("counter", "Tradier responses fetched upstream, all workers"),
+}
+
+
+class RequestStats(object):
+    """Totals for one request, shared by every thread working on it"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.upstream = {}
+        self.sqlcount = 0
+        self.sqlseconds = 0.0
+        self.scoringseconds = 0.0
+
+    def addupstream(self, service, seconds):
+        with self.lock:
+            calls, total = self.upstream.get(service, (0, 0.0))
+            self.upstream[service] = (calls + 1, total + seconds)
+
+    def addsql(self, seconds):
+        with self.lock:
+            self.sqlcount += 1
+            self.sqlseconds += seconds
+
+    def addscoring(self, seconds):
+        with self.lock:
+            self.scoringseconds += seconds
+
+    def summary(self):
+        """One line description for the slow request log"""
+        parts = ["%s %i calls %.3fs" % (service, calls, total) for service, (calls, total) in sorted(self.upstream.items())]
+        parts.append("sql %i statements %.3fs" % (self.sqlcount, self.sqlseconds))
+        parts.append("scoring %.3fs" % self.scoringseconds)
+        return ", ".join(parts)
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {}
+        self.histograms = {}
+        self.help = dict(descriptions)
+
+    # Metric primitives
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            counts, total, count = self.histograms.get(key, ([0] * len(buckets), 0.0, 0))
+            for i, bound in enumerate(buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            self.histograms[key] = (counts, total + seconds, count + 1)
+
+    # Per request totals
+
+    def begin(self):
+        self.local.stats = RequestStats()
+        return self.local.stats
+
+    def end(self):
+        stats = self.current()
+        self.local.stats = None
+        return stats
+
+    def current(self):
+        return getattr(self.local, "stats", None)
+
+    def bind(self, fn):
+        """Wrap fn so it adds to the calling thread's request totals when run on another thread"""
+        stats = self.current()
+        def run(*args, **kwargs):
+            previous = self.current()
+            self.local.stats = stats
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.local.stats = previous
+        return run
+
+    # Instrumentation points
+
+    @contextmanager
+    def upstream(self, service, endpoint):
+        """Time one outbound API call"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - started
+            self.observe("opencalc_upstream_seconds", seconds, service=service, endpoint=endpoint)
+            stats = self.current()
+            if stats is not None:
+                stats.addupstream(service, seconds)
+
+    @contextmanager
+    def scoring(self):
+        """Time strike scoring"""
+        started = time.time()
+        try:
+            yield
+        finally:
+            seconds = time.time() - started
+            self.observe("opencalc_scoring_seconds", seconds)
+            stats = self.current()
+            if stats is not None:
+                stats.addscoring(seconds)
+
+    def sql(self, seconds):
+        """Count one SQL statement"""
+        self.inc("opencalc_sql_statements_total")
+        stats = self.current()
+        if stats is not None:
+            stats.addsql(seconds)
+
+    def request(self, route, method, status, stats):
+        """Record a finished request"""
+        seconds = time.time() - stats.started
+        self.observe("opencalc_request_seconds", seconds, route=route, method=method, status=str(status))
+        self.inc("opencalc_request_sql_statements_total", stats.sqlcount, route=route)
+        for service, (calls, total) in stats.upstream.items():
+            self.inc("opencalc_request_upstream_calls_total", calls, route=route, service=service)
+        return seconds
+
+    # Prometheus text format
+
+    def render(self, extra=()):
+        """All metrics as Prometheus text, extra is a list of (name, labels, value) gauges"""
+        lines = []
+        with self.lock:
+            histograms = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.histograms.items())
+            counters = sorted(self.counters.items())
+        written = set()
+        def header(name):
+            if name in self.help and name not in written:
+                written.add(name)
+                kind, text = self.help[name]
+                lines.append("# HELP %s %s" % (name, text))
+                lines.append("# TYPE %s %s" % (name, kind))
+        for (name, labels), (counts, total, count) in histograms:
+            header(name)
+            for bound, bucketcount in zip(buckets, counts):
+                lines.append("%s_bucket%s %i" % (name, labeltext(labels + (("le", str(bound)),)), bucketcount))
+            lines.append("%s_bucket%s %i" % (name, labeltext(labels + (("le", "+Inf"),)), count))
+            lines.append("%s_sum%s %.6f" % (name, labeltext(labels), total))
+            lines.append("%s_count%s %i" % (name, labeltext(labels), count))
+        for (name, labels), value in counters:
+            header(name)
+            lines.append("%s%s %s" % (name, labeltext(labels), value))
+        for name, labels, value in extra:
+            header(name)
+            lines.append("%s%s %s" % (name, labeltext(tuple(sorted(labels.items()))), value))
+        return "\n".join(lines) + "\n"
+
+
+def labeltext(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"')) for key, value in labels) + "}"
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, flash, request, redirect, session, url_for, abort, g, make_response, send_file
+from flask import Flask, render_template, flash, request, redirect, session, url_for, abort, g, make_response, send_file, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
@@ -11,10 +11,28 @@ import array
 import math
 import time
 import csv, io
+import click
+import threading
 
 from datetime import datetime
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from iexfinance.stocks import Stock
+import numpy as np
+import pytz
+
+import scoring
+import spreads
+import greeks
+from apicache import ResponseCache
+from snapshots import SnapshotStore
+from watchlist import WatchlistCache
+from quotestream import QuotePoller
+from metrics import Metrics
 
 
 from flask_wtf import Form
@@ -35,9 +53,45 @@ def format_datetime(value, format="%B %d %Y %I:%M %p"):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+def format_percent(value):
+    """Format a fraction as a percent with one decimal, blank when missing"""
+    if value is None:
+        return ""
+    return "%.1f%%" % (value * 100)
+
+app.jinja_env.filters['percent'] = format_percent
+
+# DB connection pool - sized for the request threads of a worker plus the refresh pool
+# (SQLite keeps SQLAlchemy's own pool, which takes no size)
+if not app.config.get('SQLALCHEMY_DATABASE_URI', '').startswith('sqlite'):
+    engineoptions = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engineoptions.setdefault('pool_size', app.config.get('DB_POOL_SIZE', 10))
+    engineoptions.setdefault('max_overflow', app.config.get('DB_MAX_OVERFLOW', 10))
+    engineoptions.setdefault('pool_timeout', app.config.get('DB_POOL_TIMEOUT', 30))
+    engineoptions.setdefault('pool_recycle', app.config.get('DB_POOL_RECYCLE', 1800))
+    engineoptions.setdefault('pool_pre_ping', True)
+
 db = SQLAlchemy(app)
 Bootstrap(app)
 
+# INSTRUMENTATION - route, upstream, SQL and scoring timings for /admin/metrics
+metrics = Metrics()
+# Log requests slower than this many seconds with their breakdown (None = off)
+slowrequest = app.config.get('SLOW_REQUEST_SECONDS')
+
+# the start time lives on the statement's execution context, so a statement
+# that fails leaves nothing behind on the pooled connection
+@event.listens_for(Engine, "before_cursor_execute")
+def sqlstart(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._querystart = time.time()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def sqlend(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_querystart", None)
+    if started is not None:
+        metrics.sql(time.time() - started)
+
 # LOGIN MANAGER
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -60,8 +114,20 @@ class strikes(db.Model):
     oai = db.Column(db.String(1))  #Out of the Money / At the Money / In The Money
     oi = db.Column(db.Float) # Open Interest
     opti = db.Column(db.Float) #OPTI
+    # Black-Scholes implied volatility and Greeks from the mid price
+    iv = db.Column(db.Float)
+    delta = db.Column(db.Float)
+    gamma = db.Column(db.Float)
+    theta = db.Column(db.Float) # per day
+    vega = db.Column(db.Float) # per vol point
 
     _mapper_args__ = {"order_by":symbol}
+    # Composite indexes for the strike lookups (traderefresh, put spread long leg)
+    # and for the best put by opti desc, strike desc (csp, putspread)
+    __table_args__ = (
+        db.Index('ix_strikes_symbol_putorcall_expirationdate_strike', 'symbol', 'putorcall', 'expirationdate', 'strike'),
+        db.Index('ix_strikes_symbol_putorcall_opti_strike', 'symbol', 'putorcall', 'opti', 'strike'),
+    )
 
     def __init__(self, symbol,putorcall,expirationdate,strike,premium,volume,numdays,idtext, oi, opti, oai):
         self.symbol = symbol
@@ -83,6 +149,21 @@ class strikes(db.Model):
     def as_dict(self):
         return {c.symbol: getattr(self,c.symbol) for c in self.__table__.columns}
 
+class bestputs(db.Model):
+    # Highest OPTI cash-secured put per symbol, kept in step with strikes by refreshstrikes
+    id = db.Column(db.Integer, primary_key=True)
+    idtext = db.Column(db.String(26))
+    symbol = db.Column(db.String(12), unique=True, index=True)
+    expirationdate = db.Column(db.String(11))
+    strike = db.Column(db.Float)
+    premium = db.Column(db.Float)
+    numdays = db.Column(db.Integer)
+    opti = db.Column(db.Float)
+    updatedon = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return "<bestputs(symbol='%s', expirationdate='%s', strike='%f', opti='%f')>" % (self.symbol,self.expirationdate,self.strike,self.opti)
+
 class Crypto(db.Model):
     __tablename__ = "Crypto"
     id = db.Column(db.Integer, primary_key=True)
@@ -133,6 +214,9 @@ class Ticker(db.Model):
     tvol = db.Column(db.Float)
     tdesc = db.Column(db.String(50))
     ttype = db.Column(db.String(30))
+    __table_args__ = (
+        db.Index('ix_Ticker_user_id_symbol', 'user_id', 'symbol'),
+    )
 
     def __init__(self, symbol, tprice, user_id, tvol, tdesc, ttype,):
         self.symbol = symbol
@@ -175,6 +259,9 @@ class Trade(db.Model):
     opti = db.Column(db.Float) #OPTI
     _mapper_args__ = {"order_by":symbol}
     user_id = db.Column(db.Integer, db.ForeignKey('User.id'))
+    __table_args__ = (
+        db.Index('ix_Trade_user_id_status', 'user_id', 'status'),
+    )
 
     def __init__(self, symbol,putorcall,expirationdate,strike1,strike2,initprem, numdays, opti, strat, ror, user_id):
         self.note = "initiated"
@@ -214,6 +301,8 @@ class User(db.Model):
     totaltrades = db.Column(db.Integer)
     opentrades = db.Column(db.Integer)
     ranking = db.Column(db.Integer)
+    # bumped whenever the user's Ticker rows change, keys the /posit snapshot
+    watchversion = db.Column(db.Integer, default=0)
     tickers = db.relationship('Ticker', backref='user', lazy='dynamic')
     trades = db.relationship('Trade', backref='user', lazy='dynamic')
     cryptos = db.relationship('Crypto', backref='user', lazy='dynamic')
@@ -229,6 +318,7 @@ class User(db.Model):
         self.totaltrades = 0
         self.opentrades = 0
         self.ranking = 0
+        self.watchversion = 0
         self.tickers = tickers
         self.trades = trades
 
@@ -243,7 +333,6 @@ class User(db.Model):
 
     def is_admin(self):
         if self.id == 1:
-            g.user.is_admin = True
             return True
         else:
             if self.accesslevel > 200:
@@ -264,9 +353,66 @@ class User(db.Model):
         return '<User %r>' % (self.username)
 #
 
+def createindexes():
+    """Create indexes missing from existing tables, db.create_all() only adds them to new tables"""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(index["name"] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+
+def addcolumns():
+    """Add columns missing from existing tables, db.create_all() only creates whole tables"""
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        existing = set(column["name"] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing:
+                db.engine.execute("ALTER TABLE %s ADD COLUMN %s %s" % (preparer.format_table(table), preparer.format_column(column), column.type.compile(dialect=db.engine.dialect)))
+
 db.create_all()
+addcolumns()
+createindexes()
 db.session.commit()
 
+def setbestput(currsym, symstrikes):
+    """Replace the bestputs row for a symbol from its strike rows (dicts or strikes objects)"""
+    db.session.query(bestputs).filter(bestputs.symbol==currsym).delete()
+    best = None
+    for row in symstrikes:
+        if not isinstance(row, dict):
+            row = row.__dict__
+        if row["putorcall"] == "P" and row["opti"] > 0:
+            if best is None or (row["opti"], row["strike"]) > (best["opti"], best["strike"]):
+                best = row
+    if best is not None:
+        db.session.add(bestputs(symbol=currsym, idtext=best["idtext"], expirationdate=best["expirationdate"], strike=best["strike"], premium=best["premium"], numdays=best["numdays"], opti=best["opti"], updatedon=best["updatedon"]))
+
+def touchwatchlists(userid=None, symbol=None):
+    """Bump the watchlist version of a user, or of every user holding symbol, in the current transaction"""
+    users = db.session.query(User)
+    if userid is not None:
+        users = users.filter(User.id == userid)
+    else:
+        users = users.filter(User.id.in_(db.session.query(Ticker.user_id).filter(Ticker.symbol == symbol)))
+    users.update({"watchversion": db.func.coalesce(User.watchversion, 0) + 1}, synchronize_session=False)
+
+def watchsnapshot(user):
+    """The user's /posit snapshot, rebuilt only after their watchlist version moved"""
+    load = lambda: db.session.query(Ticker.symbol, Ticker.tprice, Ticker.priceobj, Ticker.earnsurprise, Ticker.nextearnings).filter_by(user_id=user.id).all()
+    return watchlists.get(user.id, user.watchversion or 0, load)
+
+# Fill bestputs for databases that have strikes from before it existed
+if db.session.query(bestputs.id).first() is None:
+    symstrikes = {}
+    for row in strikes.query.filter(strikes.opti > 0).filter_by(putorcall="P"):
+        symstrikes.setdefault(row.symbol, []).append(row)
+    for currsym in symstrikes:
+        setbestput(currsym, symstrikes[currsym])
+    db.session.commit()
+
 class CSPR(object):
     def __init__(self,LSym,LPrice,LExp,LDays,LStrike,LPrem,LROR,LCost):
         self.LSym = LSym
@@ -279,9 +425,182 @@ class CSPR(object):
         self.LCost = LCost
 
 # Config info for Tradier
-baseurl = "https://sandbox.tradier.com/v1/"
+baseurl = app.config.get('TRADIER_URL', "https://sandbox.tradier.com/v1/")
 authy = app.config['MYAUTHY']
 
+# Chain fetching - parallel requests per symbol and max Tradier requests per second (0 = no limit)
+chainworkers = app.config.get('CHAIN_WORKERS', 8)
+chainrate = app.config.get('CHAIN_RATE', 0)
+# Symbols refreshed at once by /refreshall and /traderefresh
+refreshworkers = app.config.get('REFRESH_WORKERS', 4)
+# Symbols per Tradier quotes request
+quotebatch = app.config.get('QUOTE_BATCH', 100)
+# Annual risk free rate for implied volatility and Greeks
+riskfreerate = app.config.get('RISK_FREE_RATE', 0.0)
+# Kept-alive Tradier connections per worker
+httppoolsize = app.config.get('HTTP_POOL_SIZE', chainworkers * refreshworkers)
+# Folder to keep every fetched chain in (None = off)
+snapshotstore = SnapshotStore(app.config['SNAPSHOT_PATH']) if app.config.get('SNAPSHOT_PATH') else None
+# Users whose /posit snapshot is kept in memory per worker
+watchlists = WatchlistCache(app.config.get('WATCHLIST_CACHE_USERS', 1000))
+
+# Shared Tradier session - keeps connections alive between calls
+tradier = requests.Session()
+tradier.headers.update({"Accept":"application/json","Authorization": authy})
+tradieradapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=httppoolsize)
+tradier.mount("https://", tradieradapter)
+tradier.mount("http://", tradieradapter)
+
+# Tradier response cache - seconds to keep each endpoint, shared by all workers
+tradierttl = app.config.get('TRADIER_CACHE_TTL', {"markets/quotes": 15, "markets/options/expirations": 3600, "markets/options/chains": 60})
+tradiercache = ResponseCache(app.config.get('TRADIER_CACHE_PATH', os.path.join(app.root_path, 'tradiercache.db')), app.config.get('TRADIER_CACHE_SIZE', 5000))
+
+ratelock = threading.Lock()
+ratenext = [0.0]
+
+def ratewait():
+    """Block until the next Tradier request is allowed under CHAIN_RATE"""
+    if not chainrate:
+        return
+    with ratelock:
+        now = time.monotonic()
+        wait = ratenext[0] - now
+        ratenext[0] = max(now, ratenext[0]) + 1.0 / chainrate
+    if wait > 0:
+        time.sleep(wait)
+
+def tradierkey(endpoint, **params):
+    """Cache key and relative url for a Tradier request"""
+    return endpoint + "?" + urlencode(sorted(params.items()), safe=",")
+
+def tradierget(endpoint, **params):
+    """GET a Tradier endpoint through the response cache, returns the parsed json"""
+    key = tradierkey(endpoint, **params)
+    ttl = tradierttl.get(endpoint, 0)
+    if ttl:
+        data = tradiercache.get(endpoint, key, ttl)
+        if data is not None:
+            return data
+    ratewait()
+    with metrics.upstream("tradier", endpoint):
+        resp = tradier.get(baseurl + key)
+    data = resp.json()
+    if ttl and resp.status_code == 200:
+        tradiercache.set(endpoint, key, data)
+    return data
+
+def quotelist(data):
+    """Quotes from a Tradier quotes response - a dict for one symbol, a list for several"""
+    quotes = (data["quotes"] or {}).get("quote", [])
+    if isinstance(quotes, dict):
+        quotes = [quotes]
+    return quotes
+
+def getquotebatch(symbols, maxage=None):
+    """Quotes for many symbols in as few Tradier requests as possible, returns {symbol: quote}
+
+    Cached quotes are used first, the rest are fetched QUOTE_BATCH symbols
+    per request and cached one symbol at a time. maxage caps the age in
+    seconds of a cached quote below the cache ttl, 0 always fetches.
+    """
+    ttl = tradierttl.get("markets/quotes", 0)
+    readttl = ttl if maxage is None else min(ttl, maxage)
+    allquotes = {}
+    pending = []
+    for sym in sorted(set(sym.upper() for sym in symbols)):
+        data = None
+        if readttl:
+            data = tradiercache.get("markets/quotes", tradierkey("markets/quotes", symbols=sym), readttl)
+        if data is None:
+            pending.append(sym)
+        else:
+            allquotes.update((quote["symbol"], quote) for quote in quotelist(data))
+    for i in range(0, len(pending), quotebatch):
+        ratewait()
+        with metrics.upstream("tradier", "markets/quotes"):
+            resp = tradier.get(baseurl + tradierkey("markets/quotes", symbols=",".join(pending[i:i + quotebatch])))
+        for quote in quotelist(resp.json()):
+            allquotes[quote["symbol"]] = quote
+            if ttl and resp.status_code == 200:
+                tradiercache.set("markets/quotes", tradierkey("markets/quotes", symbols=quote["symbol"]), {"quotes": {"quote": quote}})
+    return allquotes
+
+def getquote(sym):
+    """Quote for one symbol"""
+    return getquotebatch([sym])[sym.upper()]
+
+# IEX fundamentals - key stats and price targets change at most daily, so they are
+# cached per symbol for the trading day and fetched IEX_BATCH symbols a request
+iexbatch = app.config.get('IEX_BATCH', 100)
+iexcache = ResponseCache(app.config.get('IEX_CACHE_PATH', os.path.join(app.root_path, 'iexcache.db')), app.config.get('IEX_CACHE_SIZE', 5000))
+markettz = pytz.timezone("America/New_York")
+
+def iexfetch(endpoint, symbols):
+    """One IEX batch request for key stats or price targets, returns {symbol: data}"""
+    stockdata = Stock(symbols, token=app.config['IEX_TOKEN'])
+    with metrics.upstream("iex", endpoint):
+        if endpoint == "stats":
+            data = stockdata.get_key_stats()
+        else:
+            data = stockdata.get_price_target()
+    if len(symbols) == 1:
+        return {symbols[0]: data}
+    return data
+
+def getfundamentals(symbols):
+    """Key stats and price target for many symbols, returns {symbol: (stats, pricetarget)}
+
+    Cached ones are used first, the rest are fetched in batches with every
+    batch of both endpoints in flight at once. Missing data comes back as None.
+    """
+    day = datetime.now(markettz).strftime("%Y-%m-%d")
+    symbols = sorted(set(sym.upper() for sym in symbols))
+    found = {"stats": {}, "price-target": {}}
+    jobs = []
+    for endpoint in found:
+        pending = []
+        for sym in symbols:
+            data = iexcache.get("iex/" + endpoint, endpoint + "?symbol=" + sym + "&day=" + day, 86400)
+            if data is None:
+                pending.append(sym)
+            else:
+                found[endpoint][sym] = data
+        jobs += [(endpoint, pending[i:i + iexbatch]) for i in range(0, len(pending), iexbatch)]
+    if jobs:
+        with ThreadPoolExecutor(max_workers=min(chainworkers, len(jobs))) as pool:
+            results = pool.map(metrics.bind(lambda job: iexfetch(*job)), jobs)
+            for (endpoint, batch), data in zip(jobs, results):
+                for sym in batch:
+                    if data.get(sym) is not None:
+                        found[endpoint][sym] = data[sym]
+                        iexcache.set("iex/" + endpoint, endpoint + "?symbol=" + sym + "&day=" + day, data[sym])
+    return dict((sym, (found["stats"].get(sym), found["price-target"].get(sym))) for sym in symbols)
+
+def getchain(sym, expdate):
+    """Get the option chain for one symbol and expiration date"""
+    data = tradierget("markets/options/chains", symbol=sym, expiration=expdate)
+    return data["options"]["option"]
+
+def getchains(sym, expdates):
+    """Get the option chains for a list of expiration dates in parallel, returns {expdate: options}"""
+    if not expdates:
+        return {}
+    workers = min(chainworkers, len(expdates))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        allchains = pool.map(metrics.bind(lambda expdate: getchain(sym, expdate)), expdates)
+        return dict(zip(expdates, allchains))
+
+def flattenchains(allchains, expdates, chaindays):
+    """All the options of a set of chains in expiration order, returns (options, expdates, numdays) lists"""
+    allopts = []
+    optexps = []
+    optdays = []
+    for expdate in expdates:
+        allopts += allchains[expdate]
+        optexps += [expdate] * len(allchains[expdate])
+        optdays += [chaindays[expdate]] * len(allchains[expdate])
+    return allopts, optexps, optdays
+
 # Config info for Intrinio
 intuser = app.config['IAUTHUSER']
 intpass = app.config['IAUTHPASS']
@@ -294,8 +613,19 @@ def load_user(id):
 
 @app.before_request
 def before_request():
+    metrics.begin()
     g.user = current_user
 
+@app.after_request
+def after_request(response):
+    stats = metrics.end()
+    if stats is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        seconds = metrics.request(route, request.method, response.status_code, stats)
+        if slowrequest is not None and seconds >= slowrequest:
+            app.logger.warning("slow request %s %s %.3fs: %s", request.method, request.path, seconds, stats.summary())
+    return response
+
 @app.route('/register' , methods=['GET','POST'])
 def register():
     if request.method == 'GET':
@@ -325,11 +655,52 @@ def register():
 @login_required
 def admin():
 
-   if g.user.is_admin:
-        return render_template('admin.html', tickers = Ticker.query.order_by(Ticker.symbol).all(), users = User.query.all() )
+   if g.user.is_admin():
+        # users a page at a time after the last id shown, so deep pages cost the same as the first
+        after = request.args.get('after', 0, type=int)
+        users = adminusers(after, adminpagesize + 1)
+        nextafter = users[adminpagesize - 1]["id"] if len(users) > adminpagesize else None
+        return render_template('admin.html', users = users[:adminpagesize], after = after, nextafter = nextafter, tracked = mosttracked(admintopsymbols), cachestats = tradiercache.stats() )
    else:
         return redirect(url_for('index'))
 
+# Users per admin page and symbols in the most tracked rollup
+adminpagesize = app.config.get('ADMIN_PAGE_SIZE', 50)
+admintopsymbols = app.config.get('ADMIN_TOP_SYMBOLS', 25)
+
+def adminusers(after, limit):
+    """Users with an id above after, with ticker, open trade and total trade counts"""
+    rows = db.session.query(User.id, User.username, User.email, User.accesslevel, User.registered_on).filter(User.id > after).order_by(User.id).limit(limit).all()
+    userids = [row.id for row in rows]
+    if not userids:
+        return []
+    # one GROUP BY per table over just this page of users
+    tickercounts = dict(db.session.query(Ticker.user_id, db.func.count(Ticker.id)).filter(Ticker.user_id.in_(userids)).group_by(Ticker.user_id))
+    tradecounts = dict((row.user_id, row) for row in db.session.query(Trade.user_id, db.func.count(Trade.id).label("total"), db.func.sum(db.case([(Trade.status == 1, 1)], else_=0)).label("open")).filter(Trade.user_id.in_(userids)).group_by(Trade.user_id))
+    users = []
+    for row in rows:
+        trades = tradecounts.get(row.id)
+        user = row._asdict()
+        user.update({"tickercount": tickercounts.get(row.id, 0), "opentrades": int(trades.open or 0) if trades else 0, "totaltrades": trades.total if trades else 0})
+        users.append(user)
+    return users
+
+def mosttracked(limit):
+    """The symbols on the most watchlists, with how many users track each"""
+    users = db.func.count(db.distinct(Ticker.user_id)).label("users")
+    return db.session.query(Ticker.symbol, users).group_by(Ticker.symbol).order_by(users.desc(), Ticker.symbol).limit(limit).all()
+
+@app.route('/admin/metrics')
+@login_required
+def adminmetrics():
+   if not g.user.is_admin():
+        return redirect(url_for('index'))
+   # cache counts live in the shared cache file, so they cover every worker
+   cachestats = tradiercache.stats()
+   extra = [("opencalc_tradier_cache_hits_total", {"endpoint": stat["endpoint"]}, stat["hits"]) for stat in cachestats]
+   extra += [("opencalc_tradier_cache_misses_total", {"endpoint": stat["endpoint"]}, stat["misses"]) for stat in cachestats]
+   return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
 @app.route('/login',methods=['GET','POST'])
 def login():
     if request.method == 'GET':
@@ -350,10 +721,7 @@ def login():
     username = username.capitalize()
     admintag = " "
     if registered_user.is_admin():
-        g.user.is_admin = True
         admintag = " ADMIN "
-    else:
-        g.user_is_admin = False
     if registered_user.is_founder():
         founder = " SUPER "
     else:
@@ -383,6 +751,7 @@ def updaterank(sym,rank):
     currsym = format(sym)
     currsym = currsym.upper()
     db.session.query(Ticker.id).filter_by(symbol=currsym).update({"earnsurprise": rank})
+    touchwatchlists(symbol=currsym)
     db.session.commit()
     newmsg = "Updated " + currsym + " to rank of " + format(rank)
     flash('%s' % newmsg)
@@ -409,10 +778,9 @@ def infocalc(sym):
    currsym = format(sym)
    currsym = currsym.upper()
    form = SymbolForm()
-   IEX_TOKEN = app.config['IEX_TOKEN']
-   stockdata = Stock(currsym, token=IEX_TOKEN)
-   data2=stockdata.get_key_stats()
-   data4=stockdata.get_price_target()
+   data2, data4 = getfundamentals([currsym])[currsym]
+   data2 = data2 or {}
+   data4 = data4 or {}
   # week52high=data2["week52high"]
   # week52low=data2["week52low"]
  #  day200MovingAvg=data2["day200MovingAvg"]
@@ -447,6 +815,8 @@ def delquote(sym):
    if exists:
       db.session.query(Ticker.id).filter_by(symbol=currsym).filter_by(user_id=g.user.id).delete()
       db.session.query(strikes).filter(strikes.symbol==currsym).delete()
+      db.session.query(bestputs).filter(bestputs.symbol==currsym).delete()
+      touchwatchlists(userid=g.user.id)
       db.session.commit()
       flash('%s removed' % sym)
       return redirect(url_for('posit'))
@@ -461,18 +831,12 @@ def getquotes(sym):
    currsym = format(sym)
 
 
-   url = baseurl + "markets/quotes?symbols=" + currsym
-   headers = {"Accept":"application/json",
-           "Authorization": authy}
-   resp = requests.get(url, headers=headers)
-   status = resp.status_code
-   data = resp.json()
-   testy = data["quotes"]["quote"]
-   getvol = data["quotes"]["quote"]["volume"]
-   getsym = data["quotes"]["quote"]["symbol"]
-   getdesc = data["quotes"]["quote"]["description"]
-   getlast = data["quotes"]["quote"]["last"]
-   gettype = data["quotes"]["quote"]["type"]
+   quote = getquote(currsym)
+   getvol = quote["volume"]
+   getsym = quote["symbol"]
+   getdesc = quote["description"]
+   getlast = quote["last"]
+   gettype = quote["type"]
    testz = "Symbol: " + str(getsym) + " Description: " + str(getdesc) + " Last Price: " + str(getlast) + " Volume: " + str(getvol) + " Type: " + str(gettype)
    ticker = getsym.upper()
    uid = g.user.id
@@ -481,22 +845,77 @@ def getquotes(sym):
       flash('%s' % testz)
       newticker = Ticker(symbol=ticker, user_id=uid, tprice=getlast, tvol = getvol, tdesc = getdesc, ttype = gettype)
       db.session.add(newticker)
+      touchwatchlists(userid=uid)
       db.session.commit()
       return redirect(url_for('posit'))
    testz = "Already added"
    flash('%s' % testz)
    return redirect(url_for('posit'))
 
+# BULK IMPORT - symbols.csv layout (symbol,nextearnings,priceobj,tprice)
+def importsymbols(userid, csvfile):
+    """Add the symbols in a CSV file to a user's watchlist, returns (added, skipped) symbol lists"""
+    rows = {}
+    for row in csv.DictReader(csvfile):
+        symbol = (row.get("symbol") or "").strip().upper()
+        if symbol:
+            rows.setdefault(symbol, row)
+    # skip symbols already on the watchlist
+    existing = set(ticker.symbol for ticker in db.session.query(Ticker.symbol).filter_by(user_id=userid))
+    newsymbols = sorted(set(rows) - existing)
+    quotes = getquotebatch(newsymbols)
+    added = []
+    skipped = sorted(set(rows) & existing)
+    for symbol in newsymbols:
+        quote = quotes.get(symbol)
+        if quote is None:
+            skipped.append(symbol)
+            continue
+        newticker = Ticker(symbol=symbol, user_id=userid, tprice=quote["last"], tvol = quote["volume"], tdesc = quote["description"], ttype = quote["type"])
+        if rows[symbol].get("nextearnings"):
+            newticker.nextearnings = rows[symbol]["nextearnings"]
+        try:
+            newticker.priceobj = float(rows[symbol].get("priceobj"))
+        except (TypeError, ValueError):
+            pass
+        db.session.add(newticker)
+        added.append(symbol)
+    if added:
+        touchwatchlists(userid=userid)
+    db.session.commit()
+    return added, skipped
+
+@app.route('/upload/', methods=['POST'])
+@login_required
+def uploadsymbols():
+   upload = request.files.get('symbolsfile')
+   if not upload:
+      flash('No file selected')
+      return redirect(url_for('posit'))
+   added, skipped = importsymbols(g.user.id, io.StringIO(upload.read().decode('utf-8-sig')))
+   flash('Added %i symbols' % len(added))
+   if skipped:
+      flash('Skipped (already added or unknown): %s' % ", ".join(skipped))
+   return redirect(url_for('posit'))
+
+@app.cli.command('importsymbols')
+@click.argument('filename')
+@click.argument('username')
+def importsymbolscommand(filename, username):
+    """Import a symbols.csv file into a user's watchlist"""
+    user = User.query.filter_by(username=username.lower()).first()
+    if user is None:
+        raise click.ClickException('No user named ' + username)
+    with open(filename, newline='', encoding='utf-8-sig') as csvfile:
+        added, skipped = importsymbols(user.id, csvfile)
+    click.echo('Added %i symbols, skipped %i' % (len(added), len(skipped)))
+
 # Get Expiration Dates MANUAL - STRIKES
 @app.route('/e/<sym>')
 @login_required
 def getoptex(sym):
-   url = baseurl + "markets/options/expirations?symbol=" + format(sym)
-   headers = {"Accept":"application/json",
-           "Authorization": authy}
-   resp = requests.get(url, headers=headers)
    currsym = format(sym)
-   data = resp.json()
+   data = tradierget("markets/options/expirations", symbol=currsym)
    allexps = data["expirations"]["date"]
    sdate = []
 
@@ -543,88 +962,172 @@ def trademod(tradeid):
     db.session.commit()
     return render_template('trades.html', viewtype = "TRADES", trades = Trade.query.order_by(Trade.premcap).filter_by(user_id=g.user.id).filter_by(status=1))
 
-@app.route('/traderefresh')
-def traderefresh():
-    trades = Trade.query.filter_by(user_id=g.user.id).filter_by(status=1)
+def marktrades(trades):
+    """Mark open trades to market from the stored strikes, returns Trade update mappings"""
+    if not trades:
+        return []
+    # every strike the trades need, one query per 200 legs (under SQLite's compound select limit)
+    legs = {}
     for trade in trades:
+        legs.setdefault((trade.symbol, trade.putorcall, trade.expirationdate), set()).update([trade.strike1, trade.strike2])
+    legstrikes = {}
+    leglist = sorted(legs)
+    for i in range(0, len(leglist), 200):
+        for row in legquery(dict((leg, legs[leg]) for leg in leglist[i:i + 200])):
+            legstrikes.setdefault((row.symbol, row.putorcall, row.expirationdate, row.strike), row)
+    # current prices in one query
+    prices = {}
+    for row in db.session.query(Ticker.symbol, Ticker.tprice).filter(Ticker.symbol.in_(set(trade.symbol for trade in trades))):
+        prices.setdefault(row.symbol, row.tprice)
 
-        tradetickupdate(trade.symbol)
-        ticker = db.session.query(Ticker.tprice).filter_by(symbol=trade.symbol).first()
-        currprice = ticker.tprice
-        expdate = trade.expirationdate
-        updatestrikes(trade.symbol)
+    datety = time.strftime("%Y-%m-%d")
+    datetoday = datetime.strptime(datety,'%Y-%m-%d').date()
+    updates = []
+    unpriced = set()
+    for trade in trades:
+        currprice = prices.get(trade.symbol)
+        if currprice is None:
+            # no Ticker row (e.g. removed from the watchlist) - skipped like a missing strike
+            if trade.symbol not in unpriced:
+                unpriced.add(trade.symbol)
+                flash("NO CURRENT PRICE FOR " + trade.symbol + " - ADD IT TO THE WATCHLIST TO TRACK ITS TRADES")
+            continue
         # calculate new # of days
-        datety = time.strftime("%Y-%m-%d")
-        datetoday = datetime.strptime(datety,'%Y-%m-%d').date()
-        dateexp = datetime.strptime(format(expdate),'%Y-%m-%d').date()
+        dateexp = datetime.strptime(format(trade.expirationdate),'%Y-%m-%d').date()
         numdays = (dateexp - datetoday).days
+        strike1info = legstrikes.get((trade.symbol, trade.putorcall, trade.expirationdate, trade.strike1))
+        strike2info = legstrikes.get((trade.symbol, trade.putorcall, trade.expirationdate, trade.strike2))
+        mark = marktrade(trade, currprice, strike1info and strike1info.premium, strike2info and strike2info.premium)
+        if mark is None:
+            continue
+        mark.update({"id": trade.id, "daysleft": numdays})
+        updates.append(mark)
+    return updates
+
+def legquery(legs):
+    """Strike rows for {(symbol, putorcall, expirationdate): set of strikes}
+
+    One UNION ALL branch per leg - as a single OR, SQLite pulls out the
+    putorcall term the legs share and scans every put through its index.
+    """
+    queries = [strikes.query.filter(strikes.symbol==leg[0], strikes.putorcall==leg[1], strikes.expirationdate==leg[2], strikes.strike.in_(legs[leg])) for leg in legs]
+    return queries[0].union_all(*queries[1:])
+
+def marktrade(trade, currprice, shortprem, longprem=None):
+    """Current premium, premium captured and otm of a trade from its leg premiums, None without them"""
+    if trade.strat == 1 and shortprem is not None:     # cash-secured puts
+        newprem = shortprem
+    elif trade.strat == 2 and shortprem is not None and longprem is not None:    # put-spreads
+        newprem = (shortprem - longprem)
+    else:
+        return None
+    targetstrike = trade.strike1
+    if targetstrike == currprice:
+        otm = 0
+    else:
+        otm = ((currprice - targetstrike) / currprice) * 100
+    premcap = (trade.initprem - newprem) / trade.initprem
+    premcap = float(scoring.roundto(premcap, 0.05)) * 100
+    return {"premcap": premcap, "currprem": newprem, "otm": otm}
 
+@app.route('/traderefresh')
+@login_required
+def traderefresh():
+    trades = Trade.query.filter_by(user_id=g.user.id).filter_by(status=1).all()
+    # refresh each symbol once, even when several trades share it
+    for result in refreshsymbols(sorted(set(trade.symbol for trade in trades))):
+        if result["error"]:
+            flash("UNABLE TO REFRESH " + result["symbol"] + ": " + result["error"])
 # REFRESH TRACKING STATS
-        if trade.strat == 1:     # cash-secured puts
-            strike1info = strikes.query.filter_by(symbol=trade.symbol).filter_by(putorcall=trade.putorcall).filter_by(expirationdate=trade.expirationdate).filter_by(strike=trade.strike1).first()
-            newprem = strike1info.premium
-            targetstrike = strike1info.strike
-            if targetstrike == currprice:
-                otm = 0
-            else:
-                otm = ((currprice - targetstrike) / currprice) * 100
-            initprem = trade.initprem
-            premcap = (initprem - newprem) / initprem
-            premcap = round(round(premcap / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-            premcap = premcap * 100
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"daysleft": numdays})
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"premcap": premcap})
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"currprem": newprem})
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"otm": otm})
-        elif trade.strat == 2:    # put-spreads
-            strike1info = strikes.query.filter_by(symbol=trade.symbol).filter_by(putorcall=trade.putorcall).filter_by(expirationdate=trade.expirationdate).filter_by(strike=trade.strike1).first()
-            strike2info = strikes.query.filter_by(symbol=trade.symbol).filter_by(putorcall=trade.putorcall).filter_by(expirationdate=trade.expirationdate).filter_by(strike=trade.strike2).first()
-
-            strikeshort = strike1info.premium
-            strikelong = strike2info.premium
-            newprem = (strikeshort - strikelong)
-            initprem = trade.initprem
-            premcap = (initprem - newprem) / initprem
-            premcap = round(round(premcap / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-            premcap = premcap * 100
-            targetstrike = strike1info.strike
-            if targetstrike == currprice:
-                otm = 0
-            else:
-                otm = ((currprice - targetstrike) / currprice) * 100
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"currprem": newprem})
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"daysleft": numdays})
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"premcap": premcap})
-            db.session.query(Trade.id).filter_by(id=trade.id).update({"otm": otm})
+    updates = marktrades(trades)
+    if len(updates) < len([trade for trade in trades if trade.strat in (1, 2)]):
+        flash("SOME TRADES HAVE NO CURRENT STRIKE DATA")
+    # one executemany UPDATE for every trade
+    db.session.bulk_update_mappings(Trade, updates)
     db.session.commit()
     return render_template('trades.html', viewtype = "TRADES", trades = Trade.query.order_by(Trade.premcap).filter_by(user_id=g.user.id).filter_by(status=1))
 
     # strikeitems = strikes.query.filter_by(symbol=symbol)
     #
 
+# LIVE QUOTES - one poller per worker fetches every symbol its pages watch in one
+# batched call, so N users x M symbols is one upstream poll per symbol, and pages
+# short poll /live for what changed since their last poll
+liveinterval = app.config.get('LIVE_INTERVAL', 5)
+app.jinja_env.globals['liveinterval'] = liveinterval
+# cached quotes older than one interval would hold back changes
+quotepoller = QuotePoller(partial(getquotebatch, maxage=liveinterval), liveinterval, logger=app.logger)
+
+def occsymbol(symbol, expirationdate, putorcall, strike):
+    """OCC option symbol, e.g. AAPL210716P00150000"""
+    expdate = datetime.strptime(format(expirationdate), '%Y-%m-%d')
+    return "%s%s%s%08i" % (symbol.upper(), expdate.strftime("%y%m%d"), putorcall.upper(), round(strike * 1000))
+
+def quotepremium(quote):
+    """Bid/ask mid of an option quote rounded the way stored strikes are, None without a market"""
+    if not quote.get("bid") or not quote.get("ask"):
+        return None
+    return float(scoring.roundto((quote["bid"] + quote["ask"]) / 2, 0.05))
+
+@app.route('/live', defaults={"view": "prices"})
+@app.route('/live/<view>')
+@login_required
+def livequotes(view):
+    """Watchlist prices, or open trade marks, changed since the page's last poll
+
+    since is the "worker.version" the previous poll returned. Versions count
+    per worker, so one from another worker gets everything current.
+    """
+    worker, _, version = request.args.get("since", "").partition(".")
+    version = int(version) if worker == str(os.getpid()) and version.isdigit() else 0
+    if view == "trades":
+        trades = Trade.query.filter_by(user_id=g.user.id).filter_by(status=1).filter(Trade.strat.in_((1, 2))).all()
+        legs = dict((trade.id, [occsymbol(trade.symbol, trade.expirationdate, trade.putorcall, strike) for strike in ([trade.strike1, trade.strike2] if trade.strat == 2 else [trade.strike1])]) for trade in trades)
+        watched = set(trade.symbol.upper() for trade in trades).union(*legs.values())
+    else:
+        watched = set(row.symbol.upper() for row in db.session.query(Ticker.symbol).filter_by(user_id=g.user.id))
+    version, changed = quotepoller.since(watched, version)
+
+    result = {"since": "%i.%i" % (os.getpid(), version)}
+    if view == "trades":
+        quotes = quotepoller.latest(watched)
+        marks = []
+        for trade in trades:
+            if trade.symbol.upper() not in changed and not any(leg in changed for leg in legs[trade.id]):
+                continue
+            if trade.symbol.upper() not in quotes or any(leg not in quotes for leg in legs[trade.id]):
+                continue
+            mark = marktrade(trade, quotes[trade.symbol.upper()]["last"], *[quotepremium(quotes[leg]) for leg in legs[trade.id]])
+            if mark is not None:
+                marks.append(dict(mark, id=trade.id))
+        result["trades"] = marks
+    else:
+        result["prices"] = [{"symbol": sym, "price": quote["last"]} for sym, quote in sorted(changed.items())]
+    return Response(json.dumps(result), mimetype="application/json", headers={"Cache-Control": "no-cache"})
+
 @app.route('/tradetickupdate/<sym>')
 @login_required
 def tradetickupdate(sym):
+   refreshticker(sym)
+   flash("UPDATED " + sym.upper())
+   return redirect(url_for('posit'))
+
+def refreshticker(sym, quote=None):
+   """Update price, volume and fundamentals on the Ticker rows for a symbol, quote saves fetching it"""
    refsymbol = format(sym)
    sym = sym.upper()
-   uid = g.user.id
-   headers = {"Accept":"application/json",
-           "Authorization": authy}
-   url2 = baseurl + "markets/quotes?symbols=" + refsymbol
    # Get Stock Data
-   resp2 = requests.get(url2, headers=headers)
-   data2 = resp2.json()
-   getvol = data2["quotes"]["quote"]["volume"]
-   getsym = data2["quotes"]["quote"]["symbol"]
-   getdesc = data2["quotes"]["quote"]["description"]
-   currprice = data2["quotes"]["quote"]["last"]
-   gettype = data2["quotes"]["quote"]["type"]
+   if quote is None:
+     quote = getquote(refsymbol)
+   getvol = quote["volume"]
+   getsym = quote["symbol"]
+   getdesc = quote["description"]
+   currprice = quote["last"]
+   gettype = quote["type"]
    #
+   data2 = data4 = None
    if (gettype == "stock"):
-     IEX_TOKEN = app.config['IEX_TOKEN']
-     stockdata = Stock(sym, token=IEX_TOKEN)
-     data2=stockdata.get_key_stats()
-     data4=stockdata.get_price_target()
+     data2, data4 = getfundamentals([sym])[sym]
    # week52high=data2["week52high"]
    # week52low=data2["week52low"]
    #  day200MovingAvg=data2["day200MovingAvg"]
@@ -654,19 +1157,21 @@ def tradetickupdate(sym):
 #   priceTargetLow = data4["priceTargetLow"]
  #  numberOfAnalysts = data4["numberOfAnalysts"]
    #addnotes = "High:" + format(truncate(data2["week52high"]),1) + " Low: " + format(data2["week52low"])
-   addnotes = " 200 DMA is $" + format(data2["day200MovingAvg"])
-   addnextearnings = format(data2["nextEarningsDate"])
-   addnotes += " and P/E:" + format(data2["peRatio"])
-   addpricetarget =  data4["priceTargetAverage"]
    #
    db.session.query(Ticker.id).filter_by(symbol=refsymbol).update({"tprice": currprice})
    db.session.query(Ticker.id).filter_by(symbol=refsymbol).update({"tvol": getvol})
    db.session.query(Ticker.id).filter_by(symbol=refsymbol).update({"category": gettype})
-   if (gettype == "stock"):
+   # keep the last fundamentals when IEX has none for the symbol
+   if (gettype == "stock") and data2 is not None and data4 is not None:
+     addnotes = " 200 DMA is $" + format(data2["day200MovingAvg"])
+     addnextearnings = format(data2["nextEarningsDate"])
+     addnotes += " and P/E:" + format(data2["peRatio"])
+     addpricetarget =  data4["priceTargetAverage"]
 
      db.session.query(Ticker.id).filter_by(symbol=refsymbol).update({"nextearnings": addnextearnings})
      db.session.query(Ticker.id).filter_by(symbol=refsymbol).update({"priceobj": addpricetarget})
      db.session.query(Ticker.id).filter_by(symbol=refsymbol).update({"notes": addnotes})
+   touchwatchlists(symbol=refsymbol)
    db.session.commit()
    return
 
@@ -674,101 +1179,168 @@ def tradetickupdate(sym):
 @login_required
 def updatestrikes(sym):
     currsym = format(sym)
-    # opti multiplier to increase shorter term puts
-    optimult = 1
-    #Delete previous strike records
-    #
-    db.session.query(strikes).filter(strikes.symbol==currsym).delete()
-    db.session.commit()
-    #
+    refreshstrikes(currsym)
+    flashmsg = "UPDATED " + currsym.upper() + " WITH MOST RECENT DATA"
+    flash(flashmsg)
+    return redirect(url_for('posit'))
+
+def refreshstrikes(currsym, quote=None):
+    """Reload the strikes table for a symbol from the Tradier option chains, quote saves fetching it"""
     datety = time.strftime("%Y-%m-%d")
     datetoday = datetime.strptime(datety,'%Y-%m-%d').date()
-    headers = {"Accept":"application/json","Authorization": authy}
 
-    urlsymbol = baseurl + "markets/quotes?symbols=" + currsym
     # Get Stock Data
-    resp2 = requests.get(urlsymbol, headers=headers)
-    data2 = resp2.json()
-    currprice = data2["quotes"]["quote"]["last"]
-    roundedprice = round(round(currprice / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-    tradetickupdate(currsym)
+    if quote is None:
+        quote = getquote(currsym)
+    currprice = quote["last"]
+    refreshticker(currsym, quote)
     # End of Stock Data
 
 
     # Get Expiration Dates
-    url = baseurl + "markets/options/expirations?symbol=" + currsym
-    resp = requests.get(url, headers=headers)
-    data = resp.json()
+    data = tradierget("markets/options/expirations", symbol=currsym)
     allexps = data["expirations"]["date"]
     # End of Expiration Dates
 
-    # Symbol with all Expiration Dates loop
+    # Pull the chains for every expiration in range at once
+    chainexps = []
+    chaindays = {}
     for expdate in allexps:
-        # For Each Expiration Date - pull data
-        currexpdate = format(expdate)
-        # expiration -> currexpdate
         dateexp = datetime.strptime(format(expdate),'%Y-%m-%d').date()
         numdays = (dateexp - datetoday).days
-
-
         if (15 < numdays < 100):
-            # number of days -> numdays
-            if numdays < 30:
-               timemult = numdays / 30
-            else:
-               timemult = 30 / numdays
-               optimult = 1
-            url = baseurl + "markets/options/chains?symbol=" + currsym + "&expiration=" + currexpdate
-            resp = requests.get(url, headers=headers)
-            data = resp.json()
-            allopts = data["options"]["option"]
-            # For Each Strike for the expiration date
-            for strike in allopts:
-                asksize = strike["asksize"]
-                bidsize = strike["bidsize"]
-                oi = strike["open_interest"]
-                # update later to get real volume
-                currvolume = strike["average_volume"]
-                if (((asksize * bidsize) > 1) & (oi > 1)):
-                    currstrike = format(strike["strike"])
-                    mid = (strike["bid"] + strike["ask"])/2
-                    mid = round(round(mid / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-                    mid = round(mid,2)
-                    # premium -> mid
-                    currpremium = format(mid)
-                    if (mid > 0):
-                        if strike["option_type"] == "put":
-                            # Put Option
-                            putorcall = "P"
-                            if (roundedprice * 0.80 <= round(strike["strike"],2) <= roundedprice*1.05):
-                               oai = "O"
-                               ror = ((mid / strike["strike"]) * 100) * timemult
-                               ror = round(round(ror / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-                               otm = ((currprice - strike["strike"]) / currprice) * 100
-                               otm = round(round(otm / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-                               opti = (otm * ror) / 10
-                               opti = round(round(opti / 0.0001) * 0.0001, -int(math.floor(math.log10(0.0001))))
-                            else:
-                                oai = "I"
-                                opti = 0
-                                ror = 0
-                        else:
-                            # Call Option
-                             putorcall = "C"
-                             opti = 0
-                             oai = "I"
-
-                         # idtext = [SYMBOL] + [P/C] + EXPDATE +STRIKE
-                        curridtext = currsym + putorcall + currexpdate + currstrike
-                        curridtext = curridtext.upper()
-
-                        # (symbol,putorcall,expirationdate,strike,premium,volume,numdays,idtext, oi, opti, oai)
-                        addstrike = strikes(currsym,putorcall,currexpdate,currstrike,currpremium,currvolume,numdays,curridtext,oi,opti,oai)
-                        db.session.add(addstrike)
+            chainexps.append(format(expdate))
+            chaindays[format(expdate)] = numdays
+    allchains = getchains(currsym, chainexps)
+    if snapshotstore is not None:
+        snapshotstore.append(currsym, currprice, allchains)
+
+    # Every option in range with its expiration date and number of days
+    allopts, optexps, optdays = flattenchains(allchains, chainexps, chaindays)
+
+    # Score all strikes in one pass
+    cols = scoring.chaincolumns(allopts)
+    with metrics.scoring():
+        score = scoring.scorechain(cols, currprice, optdays)
+    keep = ((cols["asksize"] * cols["bidsize"]) > 1) & (cols["open_interest"] > 1) & (score["mid"] > 0)
+    with metrics.scoring():
+        chaingreeks = greeks.chaingreeks(cols, currprice, optdays, riskfreerate)
+    allgreeks = dict((name, greekvalues(chaingreeks[name], greekdigits[name])) for name in greekfields)
+    allmids = score["mid"].tolist()
+    allopti = score["opti"].tolist()
+    alloutofmoney = score["outofmoney"].tolist()
+
+    newstrikes = []
+    updatedon = datetime.utcnow()
+    for i in np.flatnonzero(keep).tolist():
+        strike = allopts[i]
+        currexpdate = optexps[i]
+        currstrike = format(strike["strike"])
+        if strike["option_type"] == "put":
+            # Put Option
+            putorcall = "P"
+        else:
+            # Call Option
+            putorcall = "C"
+        if alloutofmoney[i]:
+            oai = "O"
+            opti = allopti[i]
+        else:
+            oai = "I"
+            opti = 0
+
+        # idtext = [SYMBOL] + [P/C] + EXPDATE +STRIKE
+        curridtext = currsym + putorcall + currexpdate + currstrike
+        curridtext = curridtext.upper()
+
+        # update later to get real volume
+        newstrike = {"symbol":currsym, "putorcall":putorcall, "expirationdate":currexpdate, "strike":strike["strike"], "premium":allmids[i], "volume":strike["average_volume"], "numdays":optdays[i], "idtext":curridtext, "oi":strike["open_interest"], "opti":opti, "oai":oai, "updatedon":updatedon}
+        for name in greekfields:
+            newstrike[name] = allgreeks[name][i]
+        newstrikes.append(newstrike)
+    # Apply only the changes against the stored strikes, all in one transaction
+    writestrikes(currsym, newstrikes)
+    setbestput(currsym, newstrikes)
     db.session.commit()
-    flashmsg = "UPDATED " + currsym.upper() + " WITH MOST RECENT DATA"
-    flash(flashmsg)
-    return redirect(url_for('posit'))
+
+# Fields compared when a strike is already stored
+greekfields = ("iv", "delta", "gamma", "theta", "vega")
+greekdigits = {"iv": 4, "delta": 4, "gamma": 5, "theta": 4, "vega": 4}
+strikefields = ("premium", "volume", "oi", "opti", "oai", "numdays") + greekfields
+
+def greekvalues(values, digits):
+    """Rounded list for storing, None where there is no value"""
+    return [None if math.isnan(value) else round(value, digits) for value in values.tolist()]
+
+def writestrikes(currsym, newstrikes):
+    """Diff new strike rows against the stored ones by idtext - insert new ones,
+    update changed ones and delete the ones no longer in the chain"""
+    stored = {}
+    deletes = []
+    for row in db.session.query(strikes.id, strikes.idtext, *[getattr(strikes, field) for field in strikefields]).filter(strikes.symbol==currsym):
+        if row.idtext in stored:
+            deletes.append(row.id)
+        else:
+            stored[row.idtext] = row
+    inserts = []
+    updates = []
+    for newrow in dict((newrow["idtext"], newrow) for newrow in newstrikes).values():
+        row = stored.pop(newrow["idtext"], None)
+        if row is None:
+            inserts.append(newrow)
+        elif any(getattr(row, field) != newrow[field] for field in strikefields):
+            updates.append(dict(newrow, id=row.id))
+    deletes += [row.id for row in stored.values()]
+    # executemany for each kind of change
+    db.session.bulk_insert_mappings(strikes, inserts)
+    db.session.bulk_update_mappings(strikes, updates)
+    for i in range(0, len(deletes), 500):
+        db.session.query(strikes).filter(strikes.id.in_(deletes[i:i + 500])).delete(synchronize_session=False)
+
+def refreshsymbol(sym, quote=None):
+    """Refresh one symbol in its own app context, returns its timing and any error"""
+    started = time.time()
+    error = None
+    with app.app_context():
+        try:
+            refreshstrikes(sym, quote)
+        except Exception as e:
+            db.session.rollback()
+            error = str(e)
+    return {"symbol": sym, "seconds": round(time.time() - started, 2), "error": error}
+
+def refreshsymbols(symbols):
+    """Refresh a list of symbols on the worker pool"""
+    if not symbols:
+        return []
+    # one batched quote request and one batch per IEX endpoint up front - each
+    # symbol gets its quote passed in, and reads fundamentals from the daily cache
+    try:
+        allquotes = getquotebatch(symbols)
+    except Exception as e:
+        # each symbol fetches its own quote and reports its own error
+        app.logger.warning("quote prefetch failed: %s", e)
+        allquotes = {}
+    try:
+        getfundamentals([sym for sym, quote in allquotes.items() if quote["type"] == "stock"])
+    except Exception as e:
+        # each symbol retries on its own and reports the error
+        app.logger.warning("IEX prefetch failed: %s", e)
+    with ThreadPoolExecutor(max_workers=min(refreshworkers, len(symbols))) as pool:
+        return list(pool.map(metrics.bind(refreshsymbol), symbols, [allquotes.get(sym.upper()) for sym in symbols]))
+
+# REFRESH ALL - every symbol on the watchlist and in open trades
+@app.route('/refreshall')
+@login_required
+def refreshall():
+    started = time.time()
+    tickers = db.session.query(Ticker.symbol).filter_by(user_id=g.user.id)
+    trades = db.session.query(Trade.symbol).filter_by(user_id=g.user.id).filter_by(status=1)
+    symbols = sorted(set(row.symbol.upper() for row in tickers.union(trades)))
+    results = refreshsymbols(symbols)
+    errorcount = len([result for result in results if result["error"]])
+    seconds = round(time.time() - started, 2)
+    return render_template('refreshall.html', results = results, errorcount = errorcount, seconds = seconds)
 # END
 
 
@@ -784,16 +1356,8 @@ def posit(sortby):
       currsym = format(currsym)
       return redirect(url_for('getquotes',sym=currsym))
    try:
-      if sortby == 'nextearnings':
-          return render_template('posit.html', tickers = Ticker.query.order_by(Ticker.nextearnings).filter_by(user_id=g.user.id), form=form )
-      elif sortby == 'price':
-          return render_template('posit.html', tickers = Ticker.query.order_by(Ticker.tprice).filter_by(user_id=g.user.id), form=form )
-      elif sortby == 'target':
-          return render_template('posit.html', tickers = Ticker.query.order_by(Ticker.priceobj).filter_by(user_id=g.user.id), form=form )
-      elif sortby == 'rank':
-          return render_template('posit.html', tickers = Ticker.query.order_by(Ticker.earnsurprise).filter_by(user_id=g.user.id), form=form )
-      else:
-          return render_template('posit.html', tickers = Ticker.query.order_by(Ticker.symbol).filter_by(user_id=g.user.id), form=form )
+      # presorted in the cached snapshot, earnings by date with missing ones last
+      return render_template('posit.html', tickers = watchsnapshot(g.user).rows(sortby), form=form )
    except Exception as e:
        return str(e)
 
@@ -803,45 +1367,16 @@ def posit(sortby):
 
 def newposit(sortby):
     tickernum = 0
-    symbols = []
     ListCSPs = []
     errorcount = 0
-    tickers = Ticker.query.filter_by(user_id=g.user.id).order_by(Ticker.symbol).with_entities(Ticker.symbol).all()
-    for ticker in tickers:
-       symbols += list(ticker)
 
-    #symbols = list(symbols)
-    for sym in symbols:
+    for row in cspquery(g.user.id):
          # Looping for each symbol
-         symbol = format(sym)
-         #updatestrikes(symbol)
-         strike = strikes.query.filter_by(symbol=symbol).filter(strikes.opti > 0).filter_by(putorcall="P").order_by(strikes.opti.desc(),strikes.strike.desc()).limit(1)
-         if strike.count() == 0:
+         if row.bestputs is None:
              errorcount += 1
          else:
-             short = strike.first()
-             ticker = Ticker.query.filter_by(symbol=symbol).first()
-
-             tickerprice = round(ticker.tprice, 1)
-             expdate = short.expirationdate
-             shortstrike = float(short.strike)
-             opti = short.opti
-             shortpremium = short.premium
-             numdays = short.numdays
-             if numdays < 30:
-                 timemult = numdays / 30
-             else:
-                 timemult = 30 / numdays
-             acqcost = (round(round(shortstrike / 0.01) * 0.01, -int(math.floor(math.log10(0.01)))))
-             creditprem = shortpremium
-             creditprem = (round(round(creditprem / 0.01) * 0.01, -int(math.floor(math.log10(0.01)))))
-             ror = (creditprem / acqcost) * timemult
-             ror = round(round(ror / 0.001) * 0.001, -int(math.floor(math.log10(0.001))))
-             ror = ror * 100
-             ror = round(ror,3)
-             acqcost = acqcost * 100
              tickernum += 1
-         ListCSPs.append(CSPR(LSym=str(symbol),LPrice=str(tickerprice),LExp=str(expdate),LDays=str(numdays),LStrike=str(shortstrike),LPrem=str(creditprem),LROR=str(ror),LCost=str(acqcost)))
+             ListCSPs.append(bestcsp(row.symbol, row.tprice, row.bestputs))
              # end of loop
     try:
         if sortby == 'symbols':
@@ -849,55 +1384,98 @@ def newposit(sortby):
     except Exception as e:
         return str(e)
 
-#
-@app.route('/download/')
+def cspquery(userid):
+    """Each of a user's tickers with its best cash-secured put, in one query"""
+    return db.session.query(Ticker.symbol, Ticker.tprice, bestputs).outerjoin(bestputs, bestputs.symbol==Ticker.symbol).filter(Ticker.user_id==userid).order_by(Ticker.symbol)
+
+def bestcsp(symbol, tprice, short):
+    """CSPR row for a symbol's best cash-secured put"""
+    symbol = format(symbol)
+    tickerprice = round(tprice, 1)
+    expdate = short.expirationdate
+    shortstrike = float(short.strike)
+    shortpremium = short.premium
+    numdays = short.numdays
+    if numdays < 30:
+        timemult = numdays / 30
+    else:
+        timemult = 30 / numdays
+    acqcost = (round(round(shortstrike / 0.01) * 0.01, -int(math.floor(math.log10(0.01)))))
+    creditprem = shortpremium
+    creditprem = (round(round(creditprem / 0.01) * 0.01, -int(math.floor(math.log10(0.01)))))
+    ror = (creditprem / acqcost) * timemult
+    ror = round(round(ror / 0.001) * 0.001, -int(math.floor(math.log10(0.001))))
+    ror = ror * 100
+    ror = round(ror,3)
+    acqcost = acqcost * 100
+    return CSPR(LSym=str(symbol),LPrice=str(tickerprice),LExp=str(expdate),LDays=str(numdays),LStrike=str(shortstrike),LPrem=str(creditprem),LROR=str(ror),LCost=str(acqcost))
+
+# CSV EXPORTS - streamed from a server-side cursor a chunk at a time
+def streamquery(query):
+    return query.execution_options(stream_results=True).yield_per(1000)
+
+def csvrows(fieldnames, rows):
+    """Yield CSV text for a header and rows in chunks of about 8KB"""
+    proxy = io.StringIO()
+    writer = csv.writer(proxy)
+    writer.writerow(fieldnames)
+    for row in rows:
+        writer.writerow(row)
+        if proxy.tell() > 8192:
+            yield proxy.getvalue()
+            proxy.seek(0)
+            proxy.truncate(0)
+    yield proxy.getvalue()
+
+exportnames = ('symbols', 'watchlist', 'strikes', 'trades', 'archives', 'csp')
+
+@app.route('/download/', defaults={"export": "symbols"})
+@app.route('/download/<export>')
 @login_required
-def downloadsymbols():
+def downloadsymbols(export):
+    if export not in exportnames:
+        abort(404)
     try:
-        records = Ticker.query.order_by(Ticker.symbol).filter_by(user_id=g.user.id)
-#
+        userid = g.user.id
+        if export == 'symbols':
+            # same layout as symbols.csv
+            fieldnames = ['symbol','nextearnings','priceobj','tprice']
+            rows = streamquery(db.session.query(Ticker.symbol, Ticker.nextearnings, Ticker.priceobj, Ticker.tprice).filter_by(user_id=userid).order_by(Ticker.symbol))
+        elif export == 'watchlist':
+            fieldnames = ['symbol','category','tprice','tvol','priceobj','earnsurprise','nextearnings','tdesc','ttype','notes','timestamp']
+            rows = streamquery(db.session.query(*[getattr(Ticker, field) for field in fieldnames]).filter_by(user_id=userid).order_by(Ticker.symbol))
+        elif export == 'strikes':
+            fieldnames = ['symbol','putorcall','expirationdate','strike','premium','volume','oi','numdays','opti','oai','iv','delta','gamma','theta','vega','updatedon']
+            usersymbols = db.session.query(Ticker.symbol).filter_by(user_id=userid)
+            rows = streamquery(db.session.query(*[getattr(strikes, field) for field in fieldnames]).filter(strikes.symbol.in_(usersymbols)).order_by(strikes.symbol, strikes.putorcall, strikes.expirationdate, strikes.strike))
+        elif export in ('trades', 'archives'):
+            fieldnames = ['symbol','strat','putorcall','expirationdate','strike1','strike2','initprem','currprem','premcap','initnumdays','daysleft','ror','otm','opti','status']
+            status = 1 if export == 'trades' else 2
+            rows = streamquery(db.session.query(*[getattr(Trade, field) for field in fieldnames]).filter_by(user_id=userid).filter_by(status=status).order_by(Trade.symbol))
+        else:
+            fieldnames = ['symbol','price','expirationdate','numdays','strike','premium','ror','acqcost']
+            bestcsps = (bestcsp(row.symbol, row.tprice, row.bestputs) for row in streamquery(cspquery(userid)) if row.bestputs is not None)
+            rows = ([row.LSym, row.LPrice, row.LExp, row.LDays, row.LStrike, row.LPrem, row.LROR, row.LCost] for row in bestcsps)
 
-        proxy = io.StringIO()
-        #writer = csv.writer(proxy, delimiter=',')
-        fieldnames = ['symbol','nextearnings','priceobj','tprice']
-        writer = csv.DictWriter(proxy, fieldnames=fieldnames)
-        writer.writeheader()
-        proxy.flush()
-
-    #    writeline = [Symbol','Next Earnings', 'Price Objective','Current Price']
-    #    writeline = format(writeline)
-    #    writer.writerow(writeline)
-
-        for record in records:
-            #writeline = [format(record.symbol),format(record.nextearnings),format(record.priceobj),format(record.tprice)]
-            #writeline = format(writeline)
-            writer.writerow({'symbol':record.symbol,'nextearnings':record.nextearnings,'priceobj':record.priceobj,'tprice':record.tprice})
-            proxy.flush()
-        # Creating the byteIO object from the StringIO Object
-        b = bytes(proxy.getvalue(), 'utf-8')
-        buffer = io.BytesIO()
-        buffer.write(b)
-        buffer.seek(0)
-        proxy.close()
-
-        return send_file(
-            buffer,
-            as_attachment=True,
-            attachment_filename='symbols.csv',
-        )
+        response = Response(stream_with_context(csvrows(fieldnames, rows)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=' + export + '.csv'
+        return response
 #
     except Exception as e:
         return str(e)
 
 # END
 
+def bestputquery(symbol):
+    """The highest OPTI out of the money put for a symbol"""
+    return strikes.query.filter_by(symbol=symbol).filter(strikes.opti > 0).filter_by(putorcall="P").order_by(strikes.opti.desc(),strikes.strike.desc()).limit(1)
+
 # Cash-Secured Puts CSP Cash Secured Puts
 @app.route('/csp/<sym>')
 @login_required
 def csp(sym):
     symbol = format(sym)
-    strike = strikes.query.filter_by(symbol=symbol).filter(strikes.opti > 0).filter_by(putorcall="P").order_by(strikes.opti.desc(),strikes.strike.desc()).limit(1)
-    short = strike.first()
+    short = bestputquery(symbol).first()
     ticker = Ticker.query.filter_by(symbol=symbol).first()
     tickerprice = ticker.tprice
     expdate = short.expirationdate
@@ -917,186 +1495,140 @@ def csp(sym):
     ror = round(round(ror / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
     ror = ror * 100
     acqcost = acqcost * 100
-    return render_template('csp.html', tprice = tickerprice,opti = opti, symbol = symbol, shortstrike = shortstrike, expdate = expdate, initnumdays = numdays, ror = ror, acqcost = acqcost, creditprem = creditprem)
+    return render_template('csp.html', tprice = tickerprice,opti = opti, symbol = symbol, shortstrike = shortstrike, expdate = expdate, initnumdays = numdays, ror = ror, acqcost = acqcost, creditprem = creditprem, iv = short.iv, delta = short.delta, theta = short.theta)
 #
 
 
 #
 
 # Put Spreads
+# Spreads shown per symbol and widest spread as a share of the price
+spreadtop = app.config.get('SPREAD_TOP', 5)
+spreadwidth = app.config.get('SPREAD_MAX_WIDTH', 0.2)
+
+def putrowsquery(symbols):
+    """The put rows the spread search needs for a list of symbols"""
+    return db.session.query(strikes.symbol, strikes.expirationdate, strikes.strike, strikes.premium, strikes.numdays, strikes.opti, strikes.delta, strikes.iv).filter(strikes.symbol.in_(symbols)).filter_by(putorcall="P")
+
+def bestspreads(prices):
+    """Top put spreads from the stored strikes for {symbol: price}, returns {symbol: [spread dicts]}"""
+    rows = putrowsquery(list(prices)).all()
+    if not rows:
+        return {}
+    symbol, expirationdate, strike, premium, numdays, opti, delta, iv = zip(*rows)
+    currprice = [prices[sym] for sym in symbol]
+    return spreads.putspreads(symbol, expirationdate, strike, premium, numdays, opti, currprice, spreadtop, spreadwidth, delta, iv)
+
 @app.route('/ps/<sym>')
 @login_required
 def putspread(sym):
     symbol = format(sym)
-    #updatestrikes(symbol)  # newly added to refresh strikes
-
-    strike = strikes.query.filter_by(symbol=symbol).filter(strikes.opti > 0).filter_by(putorcall="P").order_by(strikes.opti.desc(),strikes.strike.desc()).limit(1)
-    short = strike.first()
-    expdate = short.expirationdate
-    strike = strikes.query.filter_by(symbol=symbol).filter(strikes.opti > 0).filter_by(expirationdate=expdate).filter_by(putorcall="P").order_by(strikes.strike.desc()).limit(1)
-    short = strike.first()
-    shortstrike = float(short.strike)
-    opti = short.opti
-    shortpremium = short.premium
-    numdays = short.numdays
-    if numdays < 30:
-        timemult = numdays / 30
-    else:
-        timemult = 30 / numdays
-    #Long Strike
-    if shortstrike < 5:
-        minstrike = 0
-    elif shortstrike < 20:
-        minstrike = shortstrike - 1
-    elif shortstrike < 50:
-        minstrike = shortstrike - 5
-    elif shortstrike < 100:
-        minstrike = shortstrike - 5
-    elif shortstrike < 300:
-        minstrike = shortstrike - 10
-    else:
-        minstrike = shortstrike - 15
-    longstrike = strikes.query.filter_by(symbol=symbol).filter_by(putorcall="P").filter_by(expirationdate=expdate).filter(strikes.strike < shortstrike).filter(strikes.strike > minstrike).order_by(strikes.strike.asc()).limit(5)
-    longst = longstrike.first()
-    longstrk = float(longst.strike)
-    longprem = longst.premium
-    margin = shortstrike - longstrk
-    margin = (round(round(margin / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))) * 100
-    acqcost = (round(round(shortstrike / 0.01) * 0.01, -int(math.floor(math.log10(0.01)))))
-    creditprem = shortpremium - longprem
-    creditprem = (round(round(creditprem / 0.01) * 0.01, -int(math.floor(math.log10(0.01)))))
-    ror = (creditprem / acqcost) * timemult
-    ror = round(round(ror / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-    ror = ror * 100
     ticker = Ticker.query.filter_by(symbol=symbol).first()
     tprice = ticker.tprice
-    acqcost = acqcost * 100
-    return render_template('putspreads.html', opti = opti, strike = longstrike, longstrk = longstrk, longprem = longprem, symbol = symbol, shortstrike = shortstrike, expdate = expdate, initnumdays = numdays, shortprem = shortpremium, ror = ror, acqcost = acqcost, margin = margin, creditprem = creditprem, tprice = tprice)
+    allspreads = bestspreads({symbol: tprice}).get(symbol)
+    if not allspreads:
+        flash("NO PUT SPREADS FOUND FOR " + symbol.upper())
+        return redirect(url_for('posit'))
+    best = allspreads[0]
+    margin = float(scoring.roundto(best["width"], 0.01)) * 100
+    acqcost = float(scoring.roundto(best["shortstrike"], 0.01)) * 100
+    return render_template('putspreads.html', delta = best["delta"], iv = best["iv"], opti = best["opti"], spreads = allspreads, longstrk = best["longstrike"], longprem = best["longprem"], symbol = symbol, shortstrike = best["shortstrike"], expdate = best["expirationdate"], initnumdays = best["numdays"], shortprem = best["shortprem"], ror = best["ror"], acqcost = acqcost, margin = margin, creditprem = best["credit"], tprice = tprice)
+
+# Best put spread for every symbol on the watchlist
+@app.route('/spreads')
+@login_required
+def watchspreads():
+    prices = dict(db.session.query(Ticker.symbol, Ticker.tprice).filter_by(user_id=g.user.id).filter(Ticker.tprice > 0))
+    allspreads = bestspreads(prices)
+    lists = [dict(allspreads[symbol][0], tprice=prices[symbol]) for symbol in sorted(allspreads)]
+    return render_template('spreads.html', lists = lists, numsymbols = len(lists))
 #
 #
 # AUTO CALC
-@app.route('/auto/<sym>')
-@login_required
-def autocalc(sym):
-   curropticsp = 0
-   curroptipss = 0
-   curroptipsl = 0
-   curropticspstrike = 0
-   curroptipssstrike = 0
-   curroptipslstrike = 0
-   curropticspprem = 0
-   curroptipssprem = 0
-   curroptipslprem = 0
-   curropticspror = 0
-   curropticspotm = 0
-
-   currprdayopticsp = 0
-   currpropticspstrike = 0
-   currpropticspprem = 0
-   currpropticspror = 0
-   currpropticspotm = 0
-   currpropticspexp = " "
-   curropticspexp = " "
-
-   refsymbol = format(sym)
-
-    #
+def gettargetprice(refsymbol):
+   """Zack's mean target price text from Intrinio"""
    tagitem = "zacks_target_price_mean"
    url = "https://api.intrinio.com/data_point?identifier="+refsymbol+"&item="+tagitem
-   resp = requests.get(url, auth=(intuser, intpass))
-   status = resp.status_code
+   with metrics.upstream("intrinio", "data_point"):
+      resp = requests.get(url, auth=(intuser, intpass))
    data = resp.json()
    if str(data["value"]) == "na":
-      targetprice = "Zack's Target Price: Not Followed"
-   else:
-      targetprice = "Zack's Target Price: " + str(data["value"])
-   #
+      return "Zack's Target Price: Not Followed"
+   return "Zack's Target Price: " + str(data["value"])
+
+@app.route('/auto/<sym>')
+@login_required
+def autocalc(sym):
+   refsymbol = format(sym)
 
    datety = time.strftime("%Y-%m-%d")
    datetoday = datetime.strptime(datety,'%Y-%m-%d').date()
-   headers = {"Accept":"application/json",
-           "Authorization": authy}
 
-   urlsymbol = baseurl + "markets/quotes?symbols=" + refsymbol
-   # Get Stock Data
-   resp2 = requests.get(urlsymbol, headers=headers)
-   data2 = resp2.json()
-   getvol = data2["quotes"]["quote"]["volume"]
-   getdesc = data2["quotes"]["quote"]["description"]
-   currprice = data2["quotes"]["quote"]["last"]
-   gettype = data2["quotes"]["quote"]["type"]
+   # Target price, quote and expirations at once - the chains follow as soon
+   # as the expirations are in, while the other two are still outstanding
+   with ThreadPoolExecutor(max_workers=3) as pool:
+      targetfuture = pool.submit(metrics.bind(gettargetprice), refsymbol)
+      quotefuture = pool.submit(metrics.bind(getquote), refsymbol)
+      expfuture = pool.submit(metrics.bind(tradierget), "markets/options/expirations", symbol=refsymbol)
+
+      # Get Expiration Dates
+      allexps = expfuture.result()["expirations"]["date"]
+      chainexps = []
+      chaindays = {}
+      for expdate in allexps:
+         dateexp = datetime.strptime(format(expdate),'%Y-%m-%d').date()
+         numdays = (dateexp - datetoday).days
+         if (numdays > 6) and (numdays < 62):
+            chainexps.append(format(expdate))
+            chaindays[format(expdate)] = numdays
+      allchains = getchains(refsymbol, chainexps)
+      # End of Expiration Dates
+
+      # Get Stock Data
+      quote = quotefuture.result()
+      targetprice = targetfuture.result()
+   getdesc = quote["description"]
+   currprice = quote["last"]
+   gettype = quote["type"]
    # End of Stock Data
-   roundedprice = round(round(currprice / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-
-   # Get Expiration Dates
-   url = baseurl + "markets/options/expirations?symbol=" + refsymbol
-   resp = requests.get(url, headers=headers)
-   data = resp.json()
-   allexps = data["expirations"]["date"]
-   # End of Expiration Dates
+   roundedprice = scoring.roundto(currprice, 0.05)
 
    gobackheading = "<a href=" + url_for('posit') + "><img src='http://www.clker.com/cliparts/b/4/b/S/d/t/square-back-text-black-md.png' width='75' height='75'></a></br>"
 
-   #
-   # Symbol with all Expiration Dates loop
-   #
-   for expdate in allexps:
-      #
-      # For Each Expiration Date - pull data
-      #
-      currexpdate = format(expdate)
-      dateexp = datetime.strptime(format(expdate),'%Y-%m-%d').date()
-      numdays = (dateexp - datetoday).days
-      if numdays < 30:
-         timemult = numdays / 30
-      else:
-         timemult = 30 / numdays
-
-      if (numdays > 6) and (numdays < 62):
-            url = baseurl + "markets/options/chains?symbol=" + format(sym) + "&expiration=" + currexpdate
-            resp = requests.get(url, headers=headers)
-            data = resp.json()
-            allopts = data["options"]["option"]
-
-            for strike in allopts:
-               if (strike["open_interest"] > 2) and (strike["asksize"] > 1) and (strike["bidsize"] > 1):
-                  mid = (strike["bid"] + strike["ask"])/2
-                  mid = round(round(mid / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-
-                  if mid > 0:
-                     # PUT SPREADS
-                     if strike["option_type"] == "put":
-                          if strike["strike"] <= roundedprice:
-                           ror = ((mid / strike["strike"]) * 100) * timemult
-                           ror = round(round(ror / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-
-                           otm = ((currprice - strike["strike"]) / currprice) * 100
-                           otm = round(round(otm / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-                           opti = (otm * ror) / 10
-                           opti = round(round(opti / 0.0001) * 0.0001, -int(math.floor(math.log10(0.0001))))
-
-
-                           if opti > curropticsp:
-                              curropticsp = opti
-                              curropticspstrike = strike["strike"]
-                              curropticspprem = mid
-                              curropticspror = ror
-                              curropticspotm = otm
-                              curropticspexp = currexpdate
-
-                           if ror >= 0.30:
-                              if ((opti+ror*2)/3) > ((currprdayopticsp+currpropticspror*2)/3):
-                                 currprdayopticsp = opti
-                                 currpropticspstrike = strike["strike"]
-                                 currpropticspprem = mid
-                                 currpropticspror = ror
-                                 currpropticspotm = otm
-                                 currpropticspexp = currexpdate
-
-
-            #
-            # End of Expiration Data Calcs
-            #
+   # Score every expiration in one pass
+   allopts, optexps, optdays = flattenchains(allchains, chainexps, chaindays)
+   cols = scoring.chaincolumns(allopts)
+   with metrics.scoring():
+      score = scoring.scorechain(cols, currprice, optdays)
+   keep = (cols["open_interest"] > 2) & (cols["asksize"] > 1) & (cols["bidsize"] > 1) & (score["mid"] > 0) & cols["isput"] & (cols["strike"] <= roundedprice)
+
+   # CASH SECURED PUTS - highest opti, ties go to the first strike as before
+   curropticspexp = " "
+   curropticspstrike = curropticspprem = curropticspror = curropticspotm = 0
+   with np.errstate(invalid="ignore"):
+      cspmask = keep & (score["opti"] > 0)
+   if cspmask.any():
+      best = int(np.argmax(np.where(cspmask, score["opti"], -np.inf)))
+      curropticspexp = optexps[best]
+      curropticspstrike = allopts[best]["strike"]
+      curropticspprem = score["mid"][best].item()
+      curropticspror = score["ror"][best].item()
+      curropticspotm = score["otm"][best].item()
+
+   # Increased rate of return - best (opti + 2 * ror) / 3 with ror of 0.30 or more
+   currpropticspexp = " "
+   currpropticspstrike = currpropticspprem = currpropticspror = currpropticspotm = 0
+   highror = (score["opti"] + score["ror"] * 2) / 3
+   with np.errstate(invalid="ignore"):
+      rormask = keep & (score["ror"] >= 0.30) & (highror > 0)
+   if rormask.any():
+      best = int(np.argmax(np.where(rormask, highror, -np.inf)))
+      currpropticspexp = optexps[best]
+      currpropticspstrike = allopts[best]["strike"]
+      currpropticspprem = score["mid"][best].item()
+      currpropticspror = score["ror"][best].item()
+      currpropticspotm = score["otm"][best].item()
+
    statustext = "</br><b> " + str(getdesc) + " (" + str(refsymbol) + ")"
    statustext = statustext + "</br>Current " + str(gettype) + " Price: $" + str(currprice)  + " and " + targetprice + "</b></br></br>"
    statustext = statustext.upper()
@@ -1119,66 +1651,56 @@ def autocalc(sym):
 @login_required
 def getorigoptinf(sym,exp):
    symb = format(sym)
-   url = baseurl + "markets/options/chains?symbol=" + symb + "&expiration=" + format(exp)
-   url2 = baseurl + "markets/quotes?symbols=" + symb
 
    datety = time.strftime("%Y-%m-%d")
    datetoday = datetime.strptime(datety,'%Y-%m-%d').date()
    dateexp = datetime.strptime(format(exp),'%Y-%m-%d').date()
    exptxtdate = str(dateexp)
    numdays = (dateexp - datetoday).days
-   if numdays < 30:
-      timemult = numdays / 30
-   else:
-      timemult = 30 / numdays
 
    backref =  url_for('getoptex',sym=format(sym))
 
 
-   headers = {"Accept":"application/json",
-           "Authorization": authy}
-   resp = requests.get(url, headers=headers)
    # Get Stock Data
-   resp2 = requests.get(url2, headers=headers)
-   data2 = resp2.json()
-   tarvol = data2["quotes"]["quote"]["volume"]
-   getsym = data2["quotes"]["quote"]["symbol"]
-   getdesc = data2["quotes"]["quote"]["description"]
-   currprice = data2["quotes"]["quote"]["last"]
-   gettype = data2["quotes"]["quote"]["type"]
+   quote = getquote(symb)
+   tarvol = quote["volume"]
+   getsym = quote["symbol"]
+   getdesc = quote["description"]
+   currprice = quote["last"]
+   gettype = quote["type"]
    #
-   data = resp.json()
-   allopts = data["options"]["option"]
+   allopts = getchain(symb, format(exp))
    puts = []
    calls = []
 
-   for strike in allopts:
-      if (strike["open_interest"] > 0 and strike["asksize"] > 0 and strike["bidsize"] > 0):
-         mid = (strike["bid"] + strike["ask"])/2
-         mid = round(round(mid / 0.05) * 0.05, -int(math.floor(math.log10(0.05))))
-
-         if mid > 0.01:
-            # PUT SPREADS
-            if strike["option_type"] == "put":
-                 ror = ((mid / strike["strike"]) * 100) * timemult
-                 ror = round(round(ror / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-                 otm = ((currprice - strike["strike"]) / currprice) * 100
-                 otm = round(round(otm / 0.01) * 0.01, -int(math.floor(math.log10(0.01))))
-                 opti = (otm * ror) / 10
-                 opti = round(round(opti / 0.0001) * 0.0001, -int(math.floor(math.log10(0.0001))))
-                 vol = strike["volume"]
-                 testthis = {"strike":strike["strike"],"mid":mid, "ror":ror, "otm":otm, "opti":opti, "vol":vol}
-
-                 puts.append(testthis)
-
-
-
-            else:
-            # LONG CALLS
-                 breakeven = mid + strike["strike"]
-                 vol = strike["volume"]
-                 testthis = {"strike":strike["strike"],"mid":mid,"breakeven":breakeven,"vol":vol}
-                 calls.append(testthis)
+   cols = scoring.chaincolumns(allopts)
+   with metrics.scoring():
+      score = scoring.scorechain(cols, currprice, numdays)
+      chaingreeks = greeks.chaingreeks(cols, currprice, numdays, riskfreerate)
+   keep = (cols["open_interest"] > 0) & (cols["asksize"] > 0) & (cols["bidsize"] > 0) & (score["mid"] > 0.01)
+   allmids = score["mid"].tolist()
+   allror = score["ror"].tolist()
+   allotm = score["otm"].tolist()
+   allopti = score["opti"].tolist()
+   alliv = greekvalues(chaingreeks["iv"], greekdigits["iv"])
+   alldelta = greekvalues(chaingreeks["delta"], greekdigits["delta"])
+   alltheta = greekvalues(chaingreeks["theta"], greekdigits["theta"])
+
+   for i in np.flatnonzero(keep).tolist():
+         strike = allopts[i]
+         mid = allmids[i]
+         # PUT SPREADS
+         if strike["option_type"] == "put":
+              vol = strike["volume"]
+              testthis = {"strike":strike["strike"],"mid":mid, "ror":allror[i], "otm":allotm[i], "opti":allopti[i], "vol":vol, "iv":alliv[i], "delta":alldelta[i], "theta":alltheta[i]}
+
+              puts.append(testthis)
+         else:
+         # LONG CALLS
+              breakeven = mid + strike["strike"]
+              vol = strike["volume"]
+              testthis = {"strike":strike["strike"],"mid":mid,"breakeven":breakeven,"vol":vol, "iv":alliv[i], "delta":alldelta[i], "theta":alltheta[i]}
+              calls.append(testthis)
    puts = sorted(puts, key=itemgetter('strike'))
    calls = sorted(calls, key=itemgetter('strike'),reverse=True)
    return render_template('mstrikes.html', backref = backref, todaydate = datetoday, tarvol = tarvol, symbol = symb, expdate = exptxtdate, numdays = numdays, currprice = currprice, puts = puts, calls=calls)
@@ -0,0 +1,94 @@
+"""Live quote fan-out for the /live short polls
+
+Each worker runs one QuotePoller. Every interval it fetches the union of
+the symbols its pages watch in one batched call and stamps the quotes that
+changed with a new version. A page polls with its symbols and the version it
+last saw and gets back only the quotes that changed since, straight from
+memory, so a poll never waits on the upstream API or holds a thread. Symbols
+no page has asked for within idle seconds are no longer fetched, and the
+poller thread sleeps while nothing is watched.
+"""
+import logging
+import threading
+import time
+
+
+class QuotePoller(object):
+    def __init__(self, fetch, interval=5, fields=("last", "bid", "ask"), idle=None, logger=None):
+        """fetch(symbols) returns {symbol: quote}, a quote counts as changed when any of fields does"""
+        self.fetch = fetch
+        self.interval = interval
+        self.fields = fields
+        # pages poll every interval, so a few missed polls means they are gone
+        self.idle = idle if idle is not None else 3 * interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.version = 0
+        self.quotes = {}
+        self.changedon = {}
+        self.watchedon = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.thread = None
+
+    def watch(self, symbols):
+        """Keep fetching symbols for another idle seconds"""
+        now = time.time()
+        with self.lock:
+            for sym in symbols:
+                self.watchedon[sym.upper()] = now
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="quotepoller", daemon=True)
+                self.thread.start()
+            self.wake.notify()
+
+    def since(self, symbols, version):
+        """Watch symbols, returns the current version and {symbol: quote} of those changed after version"""
+        self.watch(symbols)
+        with self.lock:
+            changed = dict((sym, self.quotes[sym]) for sym in set(sym.upper() for sym in symbols) if sym in self.quotes and self.changedon[sym] > version)
+            return self.version, changed
+
+    def latest(self, symbols):
+        """{symbol: quote} of the last known quotes for symbols"""
+        with self.lock:
+            return dict((sym, self.quotes[sym]) for sym in set(sym.upper() for sym in symbols) if sym in self.quotes)
+
+    def watched(self):
+        """Symbols asked for within the last idle seconds, forgets the rest"""
+        cutoff = time.time() - self.idle
+        with self.lock:
+            for sym in [sym for sym, seen in self.watchedon.items() if seen < cutoff]:
+                del self.watchedon[sym]
+            return sorted(self.watchedon)
+
+    def poll(self):
+        """Fetch every watched symbol once and stamp the changes, returns {symbol: quote} of them"""
+        symbols = self.watched()
+        fetched = self.fetch(symbols) if symbols else {}
+        changed = {}
+        with self.lock:
+            for sym, quote in fetched.items():
+                old = self.quotes.get(sym)
+                if old is None or any(old.get(field) != quote.get(field) for field in self.fields):
+                    changed[sym] = quote
+            if changed:
+                self.version += 1
+                self.quotes.update(changed)
+                self.changedon.update((sym, self.version) for sym in changed)
+            # forget symbols nobody watches any more
+            for sym in set(self.quotes) - set(symbols):
+                del self.quotes[sym]
+                del self.changedon[sym]
+        return changed
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.watchedon:
+                    self.wake.wait()
+            started = time.time()
+            try:
+                self.poll()
+            except Exception as e:
+                self.logger.warning("quote poll failed: %s", e)
+            time.sleep(max(0.0, self.interval - (time.time() - started)))
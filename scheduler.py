@@ -0,0 +1,66 @@
+# Background refresh - keeps strikes and Ticker data warm off the request path
+# Run standalone (python3 scheduler.py) or as a uWSGI mule (mule = scheduler.py)
+import logging
+import time
+from datetime import datetime
+
+import pytz
+
+from opencalc import app, db, Ticker, Trade, refreshsymbols
+
+markettz = pytz.timezone("America/New_York")
+
+# Seconds between refreshes while the market is open
+refreshinterval = app.config.get('REFRESH_INTERVAL', 900)
+
+
+def marketopen(now=None):
+    """True during regular US market hours (Mon-Fri 9:30-16:00 Eastern)"""
+    now = now or datetime.now(markettz)
+    if now.weekday() >= 5:
+        return False
+    return (9, 30) <= (now.hour, now.minute) < (16, 0)
+
+def trackedsymbols():
+    """Every symbol on a watchlist or in an open trade"""
+    with app.app_context():
+        tickers = db.session.query(Ticker.symbol)
+        trades = db.session.query(Trade.symbol).filter_by(status=1)
+        return sorted(set(row.symbol.upper() for row in tickers.union(trades)))
+
+def refreshtracked():
+    """Refresh every tracked symbol and log the results"""
+    started = time.time()
+    symbols = trackedsymbols()
+    results = refreshsymbols(symbols)
+    for result in results:
+        if result["error"]:
+            app.logger.warning("refresh %s failed: %s", result["symbol"], result["error"])
+    app.logger.info("refreshed %i symbols in %.1f seconds", len(results), time.time() - started)
+
+def saferefresh():
+    """refreshtracked, logging any error instead of ending the loop (and the mule)"""
+    try:
+        refreshtracked()
+    except Exception:
+        app.logger.exception("refresh failed, retrying on the next run")
+        db.session.rollback()
+
+def run():
+    app.logger.setLevel(logging.INFO)
+    # warm everything once at start, then on schedule while the market is open
+    # and once more after the close
+    saferefresh()
+    lastrun = time.time()
+    wasopen = marketopen()
+    while True:
+        time.sleep(60)
+        isopen = marketopen()
+        if (isopen and time.time() - lastrun >= refreshinterval) or (wasopen and not isopen):
+            saferefresh()
+            lastrun = time.time()
+        wasopen = isopen
+
+
+if __name__ == "__main__":
+    run()
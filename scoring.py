@@ -0,0 +1,53 @@
+"""Strike scoring for option chains
+
+Scores a whole chain at once from columnar arrays. Results match the
+scalar round(round(x / step) * step, ...) math used by the calculators.
+"""
+import math
+
+import numpy as np
+
+
+def roundto(x, step):
+    """Round to the nearest step, same as round(round(x / step) * step, -int(math.floor(math.log10(step))))"""
+    digits = -int(math.floor(math.log10(step)))
+    scale = 10 ** digits
+    steps = int(round(step * scale))
+    # whole steps * digits / scale is the correctly rounded decimal, + 0.0 drops -0.0
+    return np.rint(np.asarray(x, dtype=float) / step) * steps / scale + 0.0
+
+def timemult(numdays):
+    """Time multiplier for a number of days to expiration (scalar or array)"""
+    numdays = np.asarray(numdays, dtype=float)
+    with np.errstate(divide="ignore"):
+        return np.where(numdays < 30, numdays / 30, 30 / numdays)
+
+def chaincolumns(allopts):
+    """Convert a list of Tradier option dicts into columnar arrays"""
+    return {
+        "bid": np.array([opt["bid"] for opt in allopts], dtype=float),
+        "ask": np.array([opt["ask"] for opt in allopts], dtype=float),
+        "strike": np.array([opt["strike"] for opt in allopts], dtype=float),
+        "isput": np.array([opt["option_type"] == "put" for opt in allopts], dtype=bool),
+        "open_interest": np.array([opt["open_interest"] for opt in allopts], dtype=float),
+        "asksize": np.array([opt["asksize"] for opt in allopts], dtype=float),
+        "bidsize": np.array([opt["bidsize"] for opt in allopts], dtype=float),
+    }
+
+def scorechain(cols, currprice, numdays):
+    """Score a chain of options in one pass
+
+    numdays is a scalar or one value per option. Returns arrays for mid,
+    ror, otm, opti and outofmoney (puts inside 80%-105% of the price).
+    """
+    strike = cols["strike"]
+    roundedprice = roundto(currprice, 0.05)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mid = roundto((cols["bid"] + cols["ask"]) / 2, 0.05)
+        ror = roundto(((mid / strike) * 100) * timemult(numdays), 0.01)
+        otm = roundto(((currprice - strike) / currprice) * 100, 0.01)
+        opti = roundto((otm * ror) / 10, 0.0001)
+    # np.round is not correctly rounded on ties, so round the strikes the way round() does
+    roundedstrike = np.array([round(value, 2) for value in strike.tolist()], dtype=float)
+    outofmoney = cols["isput"] & (roundedprice * 0.80 <= roundedstrike) & (roundedstrike <= roundedprice * 1.05)
+    return {"mid": mid, "ror": ror, "otm": otm, "opti": opti, "outofmoney": outofmoney}
@@ -0,0 +1,92 @@
+"""Option chain snapshot store
+
+Each fetched chain is appended as one .npy file of a structured array under
+<root>/<SYMBOL>/<YYYY-MM-DD>/<HHMMSSffffff>.npy. Files are written once and
+never changed, and read back memory mapped (np.load mmap_mode='r') so
+re-scoring and backtests work straight off the page cache without copies.
+"""
+import os
+from datetime import datetime
+
+import numpy as np
+
+snapshotdtype = np.dtype([
+    ("fetchedon", "datetime64[s]"),
+    ("expirationdate", "datetime64[D]"),
+    ("underlying", "f8"),
+    ("strike", "f8"),
+    ("isput", "?"),
+    ("bid", "f8"),
+    ("ask", "f8"),
+    ("bidsize", "f8"),
+    ("asksize", "f8"),
+    ("open_interest", "f8"),
+    ("volume", "f8"),
+    ("average_volume", "f8"),
+])
+
+
+def optvalue(opt, field):
+    value = opt.get(field)
+    return np.nan if value is None else value
+
+def chainrecords(fetchedon, currprice, allchains):
+    """Structured array for a set of chains, allchains is {expdate: options}"""
+    count = sum(len(allopts) for allopts in allchains.values())
+    records = np.zeros(count, dtype=snapshotdtype)
+    records["fetchedon"] = np.datetime64(fetchedon.replace(microsecond=0), "s")
+    records["underlying"] = currprice
+    i = 0
+    for expdate, allopts in allchains.items():
+        rows = slice(i, i + len(allopts))
+        records["expirationdate"][rows] = np.datetime64(expdate, "D")
+        records["isput"][rows] = [opt["option_type"] == "put" for opt in allopts]
+        for field in ("strike", "bid", "ask", "bidsize", "asksize", "open_interest", "volume", "average_volume"):
+            records[field][rows] = [optvalue(opt, field) for opt in allopts]
+        i += len(allopts)
+    return records
+
+
+class SnapshotStore(object):
+    def __init__(self, root):
+        self.root = root
+
+    def append(self, symbol, currprice, allchains, fetchedon=None):
+        """Write one snapshot of a symbol's chains, returns its path"""
+        fetchedon = fetchedon or datetime.utcnow()
+        records = chainrecords(fetchedon, currprice, allchains)
+        folder = os.path.join(self.root, symbol.upper(), fetchedon.strftime("%Y-%m-%d"))
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, fetchedon.strftime("%H%M%S%f") + ".npy")
+        # write then rename so readers never see a partial file
+        np.save(path + ".tmp.npy", records)
+        os.replace(path + ".tmp.npy", path)
+        return path
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.listdir(self.root))
+
+    def dates(self, symbol):
+        folder = os.path.join(self.root, symbol.upper())
+        if not os.path.isdir(folder):
+            return []
+        return sorted(os.listdir(folder))
+
+    def paths(self, symbol, date):
+        folder = os.path.join(self.root, symbol.upper(), date)
+        if not os.path.isdir(folder):
+            return []
+        return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if not name.endswith(".tmp.npy")]
+
+    def read(self, symbol, date):
+        """Memory mapped snapshots of a symbol for one date, oldest first"""
+        return [np.load(path, mmap_mode="r") for path in self.paths(symbol, date)]
+
+    def last(self, symbol, date):
+        """Last snapshot of a symbol on a date, or None"""
+        paths = self.paths(symbol, date)
+        if not paths:
+            return None
+        return np.load(paths[-1], mmap_mode="r")
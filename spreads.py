@@ -0,0 +1,85 @@
+"""Put spread search over stored put strikes
+
+Rows are sorted by symbol, expiration and strike so every short strike's
+possible long strikes (lower strike, same expiration, within the maximum
+width) are one contiguous run found with searchsorted. All pairs are built
+and scored as arrays, then ranked by credit/width, ror and otm.
+"""
+import numpy as np
+
+from scoring import roundto, timemult
+
+
+def pairs(group, strike, maxwidth, shortok=None):
+    """Every (short, long) row pair in the same group with the long strike below
+    the short one by at most maxwidth (scalar or per row)
+
+    Rows must be sorted by group, then strike, and only shortok rows are
+    used as the short leg. Returns two index arrays.
+    """
+    maxwidth = np.broadcast_to(np.asarray(maxwidth, dtype=float), strike.shape)
+    # one sorted key, groups spaced further apart than any strike minus width can reach
+    scale = 2 * float(np.max(strike, initial=0)) + float(np.max(maxwidth, initial=0)) + 1
+    key = group * scale + strike
+    lo = np.searchsorted(key, key - maxwidth, side="left")
+    hi = np.searchsorted(key, key, side="left")
+    counts = hi - lo if shortok is None else np.where(shortok, hi - lo, 0)
+    short = np.repeat(np.arange(len(key)), counts)
+    long = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    return short, long
+
+def rankpairs(group, creditwidth, ror, otm, k):
+    """Positions of the top k pairs of each group, best first"""
+    order = np.lexsort((-otm, -ror, -creditwidth, group))
+    grouped = group[order]
+    starts = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return order[rank < k]
+
+def putspreads(symbol, expirationdate, strike, premium, numdays, opti, currprice, k=5, maxwidth=0.2, delta=None, iv=None):
+    """Top k put spreads per symbol from stored put rows, returns {symbol: [spread dicts]}
+
+    Every argument is one value per row; currprice is the row's symbol price.
+    Short legs are the out of the money rows (opti > 0), any put can be the
+    long leg, and spreads are at most maxwidth times the price wide. ror and
+    credit are figured the way putspread does. delta and iv, when given, are
+    passed through for the short leg (None where missing).
+    """
+    if not len(strike):
+        return {}
+    symbols, symcode = np.unique(np.asarray(symbol), return_inverse=True)
+    expirations, expcode = np.unique(np.asarray(expirationdate), return_inverse=True)
+    strike = np.asarray(strike, dtype=float)
+    premium = np.asarray(premium, dtype=float)
+    numdays = np.asarray(numdays, dtype=float)
+    opti = np.asarray(opti, dtype=float)
+    currprice = np.asarray(currprice, dtype=float)
+    delta = np.full(len(strike), np.nan) if delta is None else np.array(delta, dtype=float)
+    iv = np.full(len(strike), np.nan) if iv is None else np.array(iv, dtype=float)
+
+    order = np.lexsort((strike, expcode, symcode))
+    symcode, expcode, strike, premium, numdays, opti, currprice, delta, iv = [column[order] for column in (symcode, expcode, strike, premium, numdays, opti, currprice, delta, iv)]
+    group = np.cumsum(np.r_[False, (symcode[1:] != symcode[:-1]) | (expcode[1:] != expcode[:-1])])
+
+    short, long = pairs(group, strike, currprice * maxwidth, opti > 0)
+    credit = roundto(premium[short] - premium[long], 0.01)
+    width = strike[short] - strike[long]
+    keep = (credit > 0) & (credit < width)
+    short, long, credit, width = short[keep], long[keep], credit[keep], width[keep]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        creditwidth = roundto(credit / width, 0.01)
+        ror = roundto((credit / roundto(strike[short], 0.01)) * timemult(numdays[short]), 0.01) * 100
+        otm = roundto(((currprice[short] - strike[short]) / currprice[short]) * 100, 0.01)
+
+    best = {}
+    for i in rankpairs(symcode[short], creditwidth, ror, otm, k).tolist():
+        s, l = short[i], long[i]
+        best.setdefault(str(symbols[symcode[s]]), []).append({
+            "symbol": str(symbols[symcode[s]]), "expirationdate": str(expirations[expcode[s]]), "numdays": int(numdays[s]),
+            "shortstrike": float(strike[s]), "longstrike": float(strike[l]),
+            "shortprem": float(premium[s]), "longprem": float(premium[l]),
+            "credit": float(credit[i]), "width": round(float(width[i]), 2), "creditwidth": float(creditwidth[i]),
+            "ror": float(ror[i]), "otm": float(otm[i]), "opti": float(opti[s]),
+            "delta": None if np.isnan(delta[s]) else float(delta[s]), "iv": None if np.isnan(iv[s]) else float(iv[s]),
+        })
+    return best
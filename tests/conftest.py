@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def opencalc():
+    """opencalc imported against a throwaway SQLite database, no upstream APIs"""
+    folder = tempfile.mkdtemp()
+    settings = {
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(folder, "test.db"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+        "SECRET_KEY": "test",
+        "WTF_CSRF_ENABLED": False,
+        "MYAUTHY": "Bearer test",
+        "IAUTHUSER": "test",
+        "IAUTHPASS": "test",
+        "IEX_TOKEN": "test",
+        "REGKEY": "test",
+        "TRADIER_URL": "http://127.0.0.1:9/v1/",
+        "TRADIER_CACHE_PATH": os.path.join(folder, "tradiercache.db"),
+        "IEX_CACHE_PATH": os.path.join(folder, "iexcache.db"),
+    }
+    with open(os.path.join(folder, "settings.py"), "w") as settingsfile:
+        for name, value in settings.items():
+            settingsfile.write("%s = %r\n" % (name, value))
+    sys.path.insert(0, folder)
+    import opencalc
+    return opencalc
@@ -0,0 +1,72 @@
+"""Response cache - time to live, LRU eviction and hit/miss counts"""
+import os
+
+import pytest
+
+import apicache
+from apicache import ResponseCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(apicache, "time", clock)
+    return clock
+
+@pytest.fixture
+def cache(tmpdir, clock):
+    return ResponseCache(os.path.join(str(tmpdir), "cache.db"), maxentries=3)
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.set("quotes", "a", {"last": 1})
+    clock.now += 10
+    assert cache.get("quotes", "a", 15) == {"last": 1}
+    clock.now += 10
+    assert cache.get("quotes", "a", 15) is None
+    # a shorter ttl on the same entry is its own check
+    cache.set("quotes", "a", {"last": 2})
+    clock.now += 5
+    assert cache.get("quotes", "a", 3) is None
+    assert cache.get("quotes", "a", 60) == {"last": 2}
+
+def test_least_recently_used_evicted_past_maxentries(cache, clock):
+    for key in "abc":
+        cache.set("chains", key, key)
+        clock.now += 100
+    # a hit on a moves it ahead of b and c
+    assert cache.get("chains", "a", 1000) == "a"
+    cache.set("chains", "d", "d")
+    assert cache.get("chains", "b", 1000) is None
+    assert [cache.get("chains", key, 1000) for key in "acd"] == ["a", "c", "d"]
+
+def test_recent_hits_do_not_write(cache, clock):
+    cache.set("quotes", "a", 1)
+    conn = cache.connect()
+    clock.now += 1
+    cache.get("quotes", "a", 60)
+    assert conn.execute("SELECT usedon FROM cache WHERE key = 'a'").fetchone()[0] == 1000.0
+    clock.now += 20
+    cache.get("quotes", "a", 60)
+    assert conn.execute("SELECT usedon FROM cache WHERE key = 'a'").fetchone()[0] == 1021.0
+
+def test_stats_count_hits_and_misses(cache, clock):
+    cache.set("quotes", "a", 1)
+    cache.get("quotes", "a", 60)
+    cache.get("quotes", "a", 60)
+    cache.get("quotes", "b", 60)
+    cache.get("chains", "c", 60)
+    # nothing written until a flush is due
+    assert cache.connect().execute("SELECT COUNT(*) FROM stats").fetchone()[0] == 0
+    assert cache.stats() == [{"endpoint": "chains", "hits": 0, "misses": 1}, {"endpoint": "quotes", "hits": 2, "misses": 1}]
+    clock.now += cache.flushseconds
+    cache.get("quotes", "a", 60)
+    assert cache.connect().execute("SELECT hits FROM stats WHERE endpoint = 'quotes'").fetchone()[0] == 3
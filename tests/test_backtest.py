@@ -0,0 +1,61 @@
+"""Trade simulation - marking to market and settling at expiration"""
+import numpy as np
+
+import backtest
+from snapshots import snapshotdtype
+
+dates = ["2026-01-14", "2026-01-15", "2026-01-16"]
+
+
+def putchain(underlyings, mids):
+    """One 90 put expiring on the last day, one row per day"""
+    chain = np.zeros(len(underlyings), dtype=snapshotdtype)
+    chain["expirationdate"] = np.datetime64(dates[-1], "D")
+    chain["underlying"] = underlyings
+    chain["strike"] = 90.0
+    chain["isput"] = True
+    return chain, np.arange(len(underlyings) + 1), {"mid": np.array(mids, dtype=float)}
+
+def run(underlyings, mids):
+    chain, bounds, score = putchain(underlyings, mids)
+    return backtest.simulate("AAA", "csp", dates, chain, bounds, score, {0: (0, None)})
+
+
+def test_expired_trade_captures_whole_premium():
+    # marked well under water the day before, then expires out of the money
+    trades = run([100.0, 91.0, 95.0], [1.0, 3.55, 0.0])
+    assert len(trades) == 1
+    trade = trades[0]
+    assert trade["status"] == "expired"
+    assert trade["closed"] == dates[-1]
+    assert trade["closeprem"] == 0.0
+    assert trade["premcap"] == 100.0
+    assert trade["pnl"] == 1.0
+
+def test_assigned_trade_settles_at_intrinsic():
+    trades = run([100.0, 91.0, 88.0], [1.0, 3.55, 2.0])
+    trade = trades[0]
+    assert trade["status"] == "assigned"
+    assert trade["closeprem"] == 2.0
+    assert trade["premcap"] == -100.0
+    assert trade["pnl"] == -1.0
+
+def test_open_trade_keeps_its_mark():
+    chain, bounds, score = putchain([100.0, 91.0], [1.0, 3.55])
+    trade = backtest.simulate("AAA", "csp", dates[:2], chain, bounds, score, {0: (0, None)})[0]
+    assert trade["status"] == "open"
+    assert trade["premcap"] == -255.0
+
+def test_spread_rule_takes_top_putspreads_pair():
+    # three puts on one day, 95/90 pays the most for its width
+    chain = np.zeros(3, dtype=snapshotdtype)
+    chain["expirationdate"] = np.datetime64("2026-02-20", "D")
+    chain["underlying"] = 100.0
+    chain["strike"] = [95.0, 90.0, 85.0]
+    chain["isput"] = True
+    chain["bid"] = [1.9, 0.4, 0.2]
+    chain["ask"] = [2.1, 0.6, 0.4]
+    chain["bidsize"] = chain["asksize"] = chain["open_interest"] = 10
+    bounds = np.array([0, 3])
+    score = backtest.scoresymbol(dates[:1], chain, bounds)
+    assert backtest.picktrades("spread", chain, bounds, score) == {0: (0, 1)}
@@ -0,0 +1,45 @@
+"""Implied volatility solver and Greeks"""
+import numpy as np
+
+from greeks import bsprice, greeks, impliedvol
+
+
+def randomchain(n=2000, seed=3):
+    rng = np.random.RandomState(seed)
+    spot = rng.uniform(5, 500, n)
+    strike = spot * rng.uniform(0.6, 1.4, n)
+    t = rng.uniform(2, 400, n) / 365
+    vol = rng.uniform(0.05, 2.0, n)
+    isput = rng.rand(n) < 0.5
+    return isput, spot, strike, t, vol
+
+
+def test_round_trip():
+    isput, spot, strike, t, vol = randomchain()
+    price = bsprice(isput, spot, strike, t, vol)
+    iv = impliedvol(price, isput, spot, strike, t)
+    solved = ~np.isnan(iv)
+    # worthless far out of the money prices have no volatility to find
+    assert solved.mean() > 0.95
+    assert np.allclose(bsprice(isput[solved], spot[solved], strike[solved], t[solved], iv[solved]), price[solved], atol=1e-6)
+    vega = greeks(isput, spot, strike, t, vol)["vega"]
+    sensitive = solved & (vega > 0.01)
+    assert np.allclose(iv[sensitive], vol[sensitive], rtol=1e-4)
+
+def test_no_volatility_outside_bounds():
+    # put under intrinsic, put over the strike, call over the spot, call at zero, expired
+    iv = impliedvol([4.0, 101.0, 101.0, 0.0, 2.0], [True, True, False, False, True], 100.0, [105.0, 100.0, 100.0, 100.0, 100.0], [0.1, 0.1, 0.1, 0.1, 0.0])
+    assert np.isnan(iv).all()
+
+def test_unconverged_is_nan():
+    isput, spot, strike, t, vol = randomchain(200)
+    price = bsprice(isput, spot, strike, t, vol)
+    assert np.isnan(impliedvol(price, isput, spot, strike, t, tol=0.0, maxiter=3)).all()
+
+def test_delta_signs():
+    isput = np.array([True, True, False, False])
+    result = greeks(isput, 100.0, np.array([90.0, 110.0, 90.0, 110.0]), 0.25, 0.3)
+    assert (result["delta"][isput] < 0).all() and (result["delta"][isput] > -1).all()
+    assert (result["delta"][~isput] > 0).all() and (result["delta"][~isput] < 1).all()
+    # put-call parity
+    assert np.allclose(result["delta"][~isput] - result["delta"][isput], 1.0)
@@ -0,0 +1,49 @@
+"""EXPLAIN QUERY PLAN checks - the hot strikes lookups must search an index, never scan the table"""
+import re
+
+import pytest
+from sqlalchemy.dialects import sqlite
+
+fullscan = re.compile(r"SCAN (TABLE )?strikes\b")
+
+
+def queryplan(opencalc, query):
+    sql = str(query.statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    return [row[-1] for row in opencalc.db.engine.execute("EXPLAIN QUERY PLAN " + sql)]
+
+def assertsearches(plan, index):
+    assert not [step for step in plan if fullscan.search(step)], plan
+    assert [step for step in plan if step.startswith("SEARCH") and index in step], plan
+
+
+@pytest.fixture(scope="module")
+def db(opencalc):
+    # indexes from an older schema are added by createindexes, as on startup
+    opencalc.createindexes()
+    return opencalc.db
+
+
+def test_bestput_uses_opti_index(opencalc, db):
+    # csp
+    plan = queryplan(opencalc, opencalc.bestputquery("AAA"))
+    assertsearches(plan, "ix_strikes_symbol_putorcall_opti_strike")
+    # opti desc, strike desc comes straight off the index
+    assert not [step for step in plan if "TEMP B-TREE" in step], plan
+
+def test_trade_legs_use_strike_index(opencalc, db):
+    # traderefresh
+    legs = {("AAA", "P", "2026-12-18"): set([90.0, 85.0]), ("BBB", "P", "2027-01-15"): set([40.0])}
+    plan = queryplan(opencalc, opencalc.legquery(legs))
+    assertsearches(plan, "ix_strikes_symbol_putorcall_expirationdate_strike")
+
+def test_put_rows_use_symbol_putorcall_index(opencalc, db):
+    # putspread and /spreads
+    plan = queryplan(opencalc, opencalc.putrowsquery(["AAA", "BBB"]))
+    assert not [step for step in plan if fullscan.search(step)], plan
+    assert [step for step in plan if step.startswith("SEARCH") and "symbol=? AND putorcall=?" in step], plan
+
+def test_newposit_reads_bestputs_not_strikes(opencalc, db):
+    # newposit joins the one row per symbol bestputs table
+    plan = queryplan(opencalc, opencalc.cspquery(1))
+    assert not [step for step in plan if "strikes" in step.replace("bestputs", "")], plan
+    assert [step for step in plan if step.startswith("SEARCH bestputs")], plan
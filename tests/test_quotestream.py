@@ -0,0 +1,98 @@
+"""Live quote poller - one fetch for every watched symbol, each page gets its own changes"""
+import pytest
+
+import quotestream
+from quotestream import QuotePoller
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class Upstream(object):
+    """Fake batched quote fetch, records the symbols of each call"""
+    def __init__(self):
+        self.prices = {}
+        self.calls = []
+
+    def __call__(self, symbols):
+        self.calls.append(list(symbols))
+        return dict((sym, {"symbol": sym, "last": self.prices[sym], "bid": None, "ask": None}) for sym in symbols if sym in self.prices)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(quotestream, "time", clock)
+    return clock
+
+@pytest.fixture
+def upstream():
+    upstream = Upstream()
+    upstream.prices.update(AAA=10.0, BBB=20.0, CCC=30.0)
+    return upstream
+
+@pytest.fixture
+def poller(clock, upstream, monkeypatch):
+    poller = QuotePoller(upstream, interval=5)
+    # poll by hand rather than from the thread
+    monkeypatch.setattr(poller, "thread", object())
+    return poller
+
+
+def prices(changed):
+    return dict((sym, quote["last"]) for sym, quote in changed.items())
+
+
+def test_pages_get_only_their_own_changes(poller, upstream):
+    first, _ = poller.since(["AAA", "BBB"], 0)
+    second, _ = poller.since(["bbb", "CCC"], 0)
+    poller.poll()
+    # the union of both pages in one call
+    assert upstream.calls == [["AAA", "BBB", "CCC"]]
+    version, changed = poller.since(["AAA", "BBB"], first)
+    assert prices(changed) == {"AAA": 10.0, "BBB": 20.0}
+    othersversion, otherschanged = poller.since(["BBB", "CCC"], second)
+    assert prices(otherschanged) == {"BBB": 20.0, "CCC": 30.0}
+
+    upstream.prices["CCC"] = 31.0
+    poller.poll()
+    assert poller.since(["AAA", "BBB"], version)[1] == {}
+    assert prices(poller.since(["BBB", "CCC"], othersversion)[1]) == {"CCC": 31.0}
+
+def test_unchanged_quotes_are_not_sent_again(poller, upstream):
+    poller.since(["AAA", "BBB"], 0)
+    assert prices(poller.poll()) == {"AAA": 10.0, "BBB": 20.0}
+    version, _ = poller.since(["AAA", "BBB"], 0)
+    assert poller.poll() == {}
+    assert poller.since(["AAA", "BBB"], version) == (version, {})
+    # any of the fields counts as a change
+    upstream.prices["BBB"] = 20.5
+    changed = poller.poll()
+    assert prices(changed) == {"BBB": 20.5}
+    assert prices(poller.since(["AAA", "BBB"], version)[1]) == {"BBB": 20.5}
+    # a page without a version, or one from another worker, gets everything current
+    assert prices(poller.since(["AAA", "BBB"], 0)[1]) == {"AAA": 10.0, "BBB": 20.5}
+
+def test_unwatched_symbols_are_dropped(poller, upstream, clock):
+    poller.since(["AAA"], 0)
+    poller.since(["BBB"], 0)
+    poller.poll()
+    assert sorted(poller.quotes) == ["AAA", "BBB"]
+    # the BBB page stops polling
+    clock.now += poller.idle - 1
+    poller.since(["AAA"], 0)
+    clock.now += 2
+    poller.poll()
+    assert upstream.calls[-1] == ["AAA"]
+    assert sorted(poller.quotes) == ["AAA"]
+    assert poller.latest(["AAA", "BBB"]) == {"AAA": poller.quotes["AAA"]}
+    # and nothing is fetched once every page is gone
+    clock.now += poller.idle + 1
+    assert poller.poll() == {}
+    assert poller.quotes == {} and poller.watched() == []
+    assert len(upstream.calls) == 2
@@ -0,0 +1,91 @@
+"""Put spread search - checked against a plain loop over every pair"""
+import itertools
+
+import numpy as np
+
+from scoring import roundto, timemult
+from spreads import putspreads
+
+
+def bruteforce(rows, maxwidth):
+    """Every valid (short, long) spread of rows as (symbol, exp, short, long, creditwidth, ror, otm)"""
+    found = []
+    for short, long in itertools.permutations(rows, 2):
+        symbol, exp, strike, premium, numdays, opti, price = short
+        if long[0] != symbol or long[1] != exp or opti <= 0:
+            continue
+        width = strike - long[2]
+        if width <= 0 or width > price * maxwidth:
+            continue
+        credit = float(roundto(premium - long[3], 0.01))
+        if credit <= 0 or credit >= width:
+            continue
+        creditwidth = float(roundto(credit / width, 0.01))
+        ror = float(roundto((credit / float(roundto(strike, 0.01))) * timemult(numdays), 0.01)) * 100
+        otm = float(roundto(((price - strike) / price) * 100, 0.01))
+        found.append((symbol, exp, strike, long[2], creditwidth, ror, otm))
+    return found
+
+def search(rows, k=5, maxwidth=0.2):
+    return putspreads(*[list(column) for column in zip(*rows)], k=k, maxwidth=maxwidth)
+
+def surface():
+    """Two symbols, two expirations each, premiums falling with the strike"""
+    rng = np.random.RandomState(7)
+    rows = []
+    for symbol, price in (("AAA", 100.0), ("BBB", 40.0)):
+        for exp, numdays in (("2026-11-20", 30), ("2026-12-18", 58)):
+            for strike in np.arange(price * 0.7, price * 1.02, price / 40):
+                strike = round(float(strike), 2)
+                premium = round(max(0.05, (strike - price * 0.65) / 8 + rng.uniform(0, 0.6)), 2)
+                opti = 1.5 if strike < price else 0.0
+                rows.append((symbol, exp, strike, premium, numdays, opti, price))
+    return rows
+
+
+def test_matches_bruteforce():
+    rows = surface()
+    found = bruteforce(rows, 0.2)
+    assert len(found) > 50
+    best = search(rows, k=len(rows) ** 2)
+    assert sorted((s["symbol"], s["expirationdate"], s["shortstrike"], s["longstrike"], s["creditwidth"], s["ror"], s["otm"]) for spreads in best.values() for s in spreads) == sorted(found)
+
+def test_top_k_ranked_by_creditwidth_ror_otm():
+    rows = surface()
+    best = search(rows, k=5)
+    for symbol in ("AAA", "BBB"):
+        ranked = sorted((spread for spread in bruteforce(rows, 0.2) if spread[0] == symbol), key=lambda spread: (-spread[4], -spread[5], -spread[6]))
+        keys = [(s["creditwidth"], s["ror"], s["otm"]) for s in best[symbol]]
+        assert keys == [spread[4:] for spread in ranked[:5]]
+
+def test_credit_must_be_positive_and_under_width():
+    rows = [
+        ("AAA", "2026-11-20", 95.0, 1.00, 30, 1.0, 100.0),
+        ("AAA", "2026-11-20", 94.0, 1.00, 30, 1.0, 100.0),    # no credit
+        ("AAA", "2026-11-20", 93.0, 1.20, 30, 1.0, 100.0),    # debit
+        ("AAA", "2026-11-20", 90.0, 0.10, 30, 1.0, 100.0),    # credit 0.90 on a 5 wide spread
+    ]
+    best = search(rows, k=10)
+    assert [(s["shortstrike"], s["longstrike"]) for s in best["AAA"]] == [(93.0, 90.0), (94.0, 90.0), (95.0, 90.0)]
+    # credit as wide as the spread is no spread
+    assert search([rows[0], ("AAA", "2026-11-20", 94.0, 0.0, 30, 1.0, 100.0)]) == {}
+
+def test_maxwidth_is_inclusive():
+    rows = [
+        ("AAA", "2026-11-20", 95.0, 2.00, 30, 1.0, 100.0),
+        ("AAA", "2026-11-20", 85.0, 0.50, 30, 0.0, 100.0),
+        ("AAA", "2026-11-20", 84.5, 0.40, 30, 0.0, 100.0),
+    ]
+    best = search(rows, k=10, maxwidth=0.1)
+    assert [(s["shortstrike"], s["longstrike"]) for s in best["AAA"]] == [(95.0, 85.0)]
+
+def test_legs_stay_in_their_symbol_and_expiration():
+    rows = [
+        ("AAA", "2026-11-20", 95.0, 2.00, 30, 1.0, 100.0),
+        ("AAA", "2026-12-18", 90.0, 0.50, 58, 1.0, 100.0),
+        ("BBB", "2026-11-20", 90.0, 0.50, 30, 1.0, 100.0),
+        ("BBB", "2026-11-20", 85.0, 0.20, 30, 0.0, 100.0),
+    ]
+    best = search(rows, k=10)
+    assert list(best) == ["BBB"]
+    assert [(s["shortstrike"], s["longstrike"]) for s in best["BBB"]] == [(90.0, 85.0)]
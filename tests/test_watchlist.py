@@ -0,0 +1,89 @@
+"""Watchlist snapshots - cached per user and watchlist version, presorted per sort key"""
+from datetime import date
+
+from watchlist import WatchlistCache, WatchlistSnapshot
+
+tickers = [
+    ("CCC", 30.0, 35.0, 2.0, "2026-11-03"),
+    ("AAA", 10.0, None, 1.0, "No Data"),
+    ("BBB", 20.0, 25.0, None, date(2026, 10, 28)),
+    ("DDD", 40.0, 45.0, 3.0, None),
+    ("EEE", 50.0, 55.0, 4.0, "2026-10-28"),
+]
+
+
+class Loader(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.rows
+
+
+def symbols(rows):
+    return [row.symbol for row in rows]
+
+
+def test_same_version_is_a_hit():
+    cache = WatchlistCache()
+    load = Loader(tickers)
+    snapshot = cache.get(1, 0, load)
+    assert cache.get(1, 0, load) is snapshot
+    assert load.calls == 1
+
+def test_version_bump_rebuilds():
+    cache = WatchlistCache()
+    cache.get(1, 0, Loader(tickers))
+    load = Loader(tickers[:2])
+    snapshot = cache.get(1, 1, load)
+    assert load.calls == 1
+    assert symbols(snapshot.rows("symbol")) == ["AAA", "CCC"]
+    assert cache.get(1, 1, load) is snapshot
+
+def test_least_recently_used_user_evicted():
+    cache = WatchlistCache(maxusers=2)
+    loads = dict((userid, Loader(tickers)) for userid in (1, 2, 3))
+    cache.get(1, 0, loads[1])
+    cache.get(2, 0, loads[2])
+    # 1 was used last, so 2 goes
+    cache.get(1, 0, loads[1])
+    cache.get(3, 0, loads[3])
+    assert list(cache.snapshots) == [1, 3]
+    cache.get(3, 0, loads[3])
+    cache.get(2, 0, loads[2])
+    assert list(cache.snapshots) == [3, 2]
+    assert (loads[1].calls, loads[2].calls, loads[3].calls) == (1, 2, 1)
+
+def test_nextearnings_sorts_by_date_missing_last():
+    snapshot = WatchlistSnapshot(tickers)
+    rows = snapshot.rows("nextearnings")
+    # date objects and strings sort as dates, ties by symbol, No Data and None last
+    assert symbols(rows) == ["BBB", "EEE", "CCC", "AAA", "DDD"]
+    assert rows[0].earningsdate == date(2026, 10, 28)
+    assert rows[0].nextearnings == date(2026, 10, 28)
+
+def test_missing_values_sort_last():
+    snapshot = WatchlistSnapshot(tickers)
+    assert symbols(snapshot.rows("target")) == ["BBB", "CCC", "DDD", "EEE", "AAA"]
+    assert symbols(snapshot.rows("rank")) == ["AAA", "CCC", "DDD", "EEE", "BBB"]
+    assert symbols(snapshot.rows("unknown")) == symbols(snapshot.rows("symbol")) == ["AAA", "BBB", "CCC", "DDD", "EEE"]
+
+def test_ticker_changes_bump_only_holders(opencalc):
+    db = opencalc.db
+    with opencalc.app.app_context():
+        holder = opencalc.User("watchholder", "x", "holder@example.com", "")
+        other = opencalc.User("watchother", "x", "other@example.com", "")
+        db.session.add_all([holder, other])
+        db.session.flush()
+        db.session.add(opencalc.Ticker("WWW", 10.0, holder.id, 0, "", ""))
+        db.session.commit()
+        opencalc.touchwatchlists(symbol="WWW")
+        opencalc.touchwatchlists(userid=holder.id)
+        db.session.commit()
+        db.session.expire_all()
+        assert (holder.watchversion, other.watchversion) == (2, 0)
+        snapshot = opencalc.watchsnapshot(holder)
+        assert opencalc.watchsnapshot(holder) is snapshot
+        assert symbols(snapshot.rows("symbol")) == ["WWW"]
@@ -0,0 +1,69 @@
+"""Per-user watchlist snapshots for the /posit page
+
+A snapshot holds a user's Ticker rows as plain tuples plus one presorted
+ordering per sort key, so switching sort order is a dict lookup. Snapshots
+are cached in process memory under the user's watchlist version; anything
+that changes a user's Ticker rows bumps that version in the database, so
+every worker rebuilds on its next request instead of serving stale rows.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+watchrow = namedtuple("watchrow", ["symbol", "tprice", "priceobj", "earnsurprise", "nextearnings", "earningsdate"])
+
+# /posit sort name -> row field, missing values sort last
+sortfields = {
+    "nextearnings": "earningsdate",
+    "price": "tprice",
+    "target": "priceobj",
+    "rank": "earnsurprise",
+    "symbol": "symbol",
+}
+
+
+def parsedate(value):
+    """date from an IEX YYYY-MM-DD string, None for "No Data" and the like"""
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+def ordering(rows, field):
+    """rows sorted on field, ties and missing values by symbol"""
+    present = [row for row in rows if getattr(row, field) is not None]
+    missing = [row for row in rows if getattr(row, field) is None]
+    return tuple(sorted(present, key=lambda row: (getattr(row, field), row.symbol)) + missing)
+
+
+class WatchlistSnapshot(object):
+    def __init__(self, tickers):
+        """tickers are (symbol, tprice, priceobj, earnsurprise, nextearnings) rows"""
+        rows = sorted((watchrow(*ticker, earningsdate=parsedate(ticker[4])) for ticker in tickers), key=lambda row: row.symbol)
+        self.orders = dict((sortby, ordering(rows, field)) for sortby, field in sortfields.items())
+
+    def rows(self, sortby):
+        """Rows in a sort order, by symbol for an unknown one"""
+        return self.orders.get(sortby, self.orders["symbol"])
+
+
+class WatchlistCache(object):
+    def __init__(self, maxusers=1000):
+        self.maxusers = maxusers
+        self.snapshots = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, userid, version, load):
+        """Snapshot for a user at a watchlist version, load() returns the ticker rows on a miss"""
+        with self.lock:
+            cached = self.snapshots.get(userid)
+            if cached is not None and cached[0] == version:
+                self.snapshots.move_to_end(userid)
+                return cached[1]
+        snapshot = WatchlistSnapshot(load())
+        with self.lock:
+            self.snapshots[userid] = (version, snapshot)
+            self.snapshots.move_to_end(userid)
+            while len(self.snapshots) > self.maxusers:
+                self.snapshots.popitem(last=False)
+        return snapshot